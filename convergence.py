@@ -0,0 +1,185 @@
+"""
+Early termination of runs whose CPI has converged
+
+The timed part of the trace (between `csrr minstret` markers) is cut in
+windows of `window` committed instructions. The CPI of the windows are
+treated as batch means: their mean estimates the CPI of the whole timed
+part, and their standard error gives a confidence interval. Once the half
+width of the interval is within `tolerance` of the mean, the run stops and
+the cycles of the remaining instructions are extrapolated.
+
+Windows must be long compared to the loops of the program, for their CPI to
+be nearly independent: the default of 1000 instructions suits CoreMark.
+"""
+
+import sys
+import math
+import time
+import argparse
+
+from statistics import NormalDist, fmean, stdev
+
+from model import Model, TimedStats, print_data
+from roi import re_csrr_minstret
+
+class ConvergenceMonitor:
+    """Follows the CPI of the timed part, stops the model when it has converged"""
+
+    def __init__(self, n_timed, tolerance=0.01, window=1000, confidence=0.95, min_windows=10):
+        """n_timed: instructions in the timed part of the whole trace"""
+        self.n_timed = n_timed
+        self.tolerance = tolerance
+        self.window = window
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.min_windows = min_windows
+        self.accepting = False
+        self.n_instr = 0
+        self.first_cycle = None
+        self.last_cycle = None
+        # First event cycle of the instructions not committed yet, by id
+        self.in_flight = {}
+        self.window_start = None
+        self.cpis = []
+        self.converged = False
+
+    def event(self, instr, event):
+        """Event subscriber, for events of all kinds
+
+        Elapsed cycles start at the first event of the first timed
+        instruction, as in TimedStats."""
+        # Events are logged in cycle order
+        first = self.in_flight.setdefault(id(instr), event.cycle)
+        if event.kind.name == "commit":
+            del self.in_flight[id(instr)]
+            self.commit(instr, event, first)
+
+    def commit(self, instr, event, first=None):
+        """Commit of an instruction whose first event is at cycle first"""
+        if re_csrr_minstret.search(instr.mnemo):
+            self.accepting = not self.accepting
+            return
+        if not self.accepting:
+            return
+        self.n_instr += 1
+        self.last_cycle = event.cycle
+        if self.first_cycle is None:
+            self.first_cycle = event.cycle if first is None else first
+            self.window_start = event.cycle
+        elif (self.n_instr - 1) % self.window == 0:
+            self.cpis.append((event.cycle - self.window_start) / self.window)
+            self.window_start = event.cycle
+            self.converged = self.converged or self._within_tolerance()
+
+    def cycle(self, model, cycle):
+        """Stop the model at the end of the cycle in which the CPI converged"""
+        if self.converged:
+            model.stopped = True
+
+    def half_width(self):
+        """Half width of the confidence interval of the CPI"""
+        if len(self.cpis) < 2:
+            return math.inf
+        return self.z * stdev(self.cpis) / math.sqrt(len(self.cpis))
+
+    def _within_tolerance(self):
+        return len(self.cpis) >= self.min_windows \
+            and self.half_width() <= self.tolerance * fmean(self.cpis)
+
+    def estimate(self):
+        """Extrapolated cycles of the timed part, their confidence bound in
+        cycles and the fraction of the timed part simulated"""
+        if self.first_cycle is None:
+            return {"cycles": 0, "bound": 0, "fraction": 0.0}
+        elapsed = self.last_cycle - self.first_cycle
+        remaining = max(self.n_timed - self.n_instr, 0)
+        if remaining == 0 or not self.cpis:
+            return {"cycles": elapsed, "bound": 0, "fraction": 1.0}
+        return {
+            "cycles": round(elapsed + fmean(self.cpis) * remaining),
+            "bound": round(self.half_width() * remaining),
+            "fraction": self.n_instr / self.n_timed,
+        }
+
+def count_timed(instructions):
+    """Instructions between pairs of markers, markers excluded"""
+    n_timed = 0
+    accepting = False
+    for instr in instructions:
+        if re_csrr_minstret.search(instr.mnemo):
+            accepting = not accepting
+        elif accepting:
+            n_timed += 1
+    return n_timed
+
+def attach(model, tolerance=0.01, window=1000, confidence=0.95):
+    """Stop a model run once the CPI of the timed part is known within a
+    relative tolerance, returns the monitor which extrapolates the cycles
+
+    The whole trace must be loaded, to count its timed instructions."""
+    if model.source is not None:
+        raise ValueError("early termination needs a loaded trace, see run_converged")
+    monitor = ConvergenceMonitor(count_timed(model.instr_queue), tolerance, window, confidence)
+    model.subscribe(monitor.event)
+    model.subscribe_cycles(monitor.cycle)
+    return monitor
+
+def run_converged(instructions, tolerance=0.01, window=1000, confidence=0.95, **params):
+    """Statistics of the timed part of a run stopped once its CPI has converged
+
+    cycles, coremark_mhz and instructions cover the whole timed part, bound
+    is the confidence bound of cycles and fraction the part simulated.
+    simulated_instructions are the timed instructions simulated, on which
+    events are counted."""
+    instructions = list(instructions)
+    model = Model(keep_retired=False, keep_log=False, **params)
+    model.load_stream(instructions)
+    monitor = ConvergenceMonitor(count_timed(instructions), tolerance, window, confidence)
+    model.subscribe(monitor.event)
+    model.subscribe_cycles(monitor.cycle)
+    stats = TimedStats()
+    model.subscribe(stats.event)
+    model.run()
+    summary = stats.summary()
+    summary["simulated_instructions"] = summary["instructions"]
+    summary["instructions"] = monitor.n_timed
+    estimate = monitor.estimate()
+    if estimate["fraction"] < 1:
+        summary["cycles"] = estimate["cycles"]
+        summary["coremark_mhz"] = 1000000 / estimate["cycles"]
+    summary["bound"] = estimate["bound"]
+    summary["fraction"] = estimate["fraction"]
+    return summary
+
+def main(argv):
+    "Entry point: compare a run stopped at convergence with a complete one"
+    parser = argparse.ArgumentParser(description="Early termination at CPI convergence")
+    parser.add_argument("trace", help="RVFI trace")
+    parser.add_argument("--issue", type=int, default=2)
+    parser.add_argument("--commit", type=int, default=2)
+    parser.add_argument("--tolerance", type=float, default=0.01,
+                        help="relative half width of the confidence interval")
+    parser.add_argument("--window", type=int, default=1000, help="instructions per window")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--check", action="store_true", help="also run the whole trace")
+    args = parser.parse_args(argv)
+
+    runs = [True, False] if args.check else [True]
+    for converge in runs:
+        model = Model(issue=args.issue, commit=args.commit, keep_retired=False, keep_log=False,
+                      record_events=False)
+        model.load_file(args.trace)
+        monitor = attach(model, args.tolerance, args.window, args.confidence)
+        if not converge:
+            monitor.tolerance = 0
+        start = time.time()
+        model.run()
+        elapsed = time.time() - start
+        result = monitor.estimate()
+        name = "early stop" if converge else "complete"
+        print_data(name, f"{result['cycles']} +/- {result['bound']} cycles in {elapsed:.2f}s")
+        if converge:
+            print_data("simulated", f"{100 * result['fraction']:.1f}% of the timed part "
+                       f"({len(monitor.cpis)} windows)")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,9 +1,11 @@
 import re
 import sys
 
+from parallel_parse import Groups, parse_parallel
+
 re_csrr_minstret = re.compile(r"^csrr\s+\w+,\s*minstret$")
 re_full = re.compile(
-    r"([a-z]+)\s+0:\s*0x00000000([0-9a-f]+)\s*\(([0-9a-fx]+)\)\s*(\S*)@\s*([0-9]+)\s*(.*)"
+    r"([a-z]+)\s+([0-9]+):\s*0x00000000([0-9a-f]+)\s*\(([0-9a-fx]+)\)\s*(\S*)@\s*([0-9]+)\s*(.*)"
 )
 
 class Trace:
@@ -23,28 +25,43 @@ def print_data(name, value):
     spaces = ' ' * (24 - len(name))
     print(f"{name}{spaces} = {value}")
 
-def read_traces(input_file):
-    "Collect stage traces from file"
-    l = []
-    def filter_add(trace):
-        if not hasattr(filter_add, "accepting"):
-            filter_add.accepting = False
-        if re_csrr_minstret.search(trace.mnemo):
-            filter_add.accepting = not filter_add.accepting
-            return
-        if filter_add.accepting:
-            l.append(trace)
+def read_hart_traces(input_file):
+    "Collect stage traces from file, by hart id in order of appearance"
+    harts = {}
+    accepting = {}
     with open(input_file, "r", encoding="utf8") as f:
-        for line in [l.strip() for l in f]:
+        for line in (l.strip() for l in f):
             found = re_full.search(line)
             if found:
-                addr = found.group(2)
-                flags = found.group(4)
-                cycle = int(found.group(5))
-                mnemo = found.group(6)
-                filter_add(Trace(addr, cycle, mnemo, flags))
-                #l.append(Trace(addr, cycle, mnemo, flags))
-    return l
+                hart = int(found.group(2))
+                l = harts.setdefault(hart, [])
+                addr = found.group(3)
+                flags = found.group(5)
+                cycle = int(found.group(6))
+                mnemo = found.group(7)
+                if re_csrr_minstret.search(mnemo):
+                    accepting[hart] = not accepting.get(hart, False)
+                elif accepting.get(hart, False):
+                    l.append(Trace(addr, cycle, mnemo, flags))
+    return harts
+
+def read_traces(input_file):
+    "Collect stage traces from file (of the first hart)"
+    return next(iter(read_hart_traces(input_file).values()), [])
+
+def read_hart_traces_parallel(input_file, workers=None):
+    "Collect stage traces from file by hart id, parsed by several processes"
+    parsed = parse_parallel(input_file, re_full.pattern, Groups(2, 3, 4, 6, 7, 5),
+                            re_csrr_minstret.pattern, workers)
+    return {
+        hart: [Trace(f"{p.addresses[i]:0{p.address_widths[i]}x}", p.cycles[i],
+                     p.mnemos[p.mnemo_ids[i]], p.flags[p.flag_ids[i]]) for i in p.timed()]
+        for hart, p in parsed.split_harts().items()
+    }
+
+def read_traces_parallel(input_file, workers=None):
+    "Collect stage traces from file (of the first hart), parsed by several processes"
+    return next(iter(read_hart_traces_parallel(input_file, workers).values()), [])
 
 def write_traces(outfile, traces):
     "Write all instructions to output file"
@@ -53,9 +70,11 @@ def write_traces(outfile, traces):
         for trace in traces:
             f.write(trace.report() + "\n")
 
-def main(input_file: str):
-    "Main function"
-    traces = read_traces(input_file)
+def report(traces, outfile):
+    "Print the statistics of the traces of a hart and write them"
+    if not traces:
+        print("no timed part")
+        return
     cycle = traces[0].cycle
     cycle_number = traces[-1].cycle - cycle + 1
     for trace in traces:
@@ -65,7 +84,20 @@ def main(input_file: str):
     print_data("Coremark/MHz", 1000000 / cycle_number)
     print_data("instruction number", len(traces))
     print_data("IPC", len(traces) / cycle_number)
-    write_traces("traceout.log", traces)
+    write_traces(outfile, traces)
+
+def main(input_file: str, workers=None):
+    "Main function"
+    if workers and workers > 1:
+        harts = read_hart_traces_parallel(input_file, workers)
+    else:
+        harts = read_hart_traces(input_file)
+    if len(harts) == 1:
+        report(next(iter(harts.values())), "traceout.log")
+        return
+    for hart, traces in harts.items():
+        print(f"hart {hart}")
+        report(traces, f"traceout-{hart}.log")
 
 if __name__ == "__main__":
-    main(sys.argv[1])
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None)
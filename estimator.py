@@ -0,0 +1,211 @@
+"""
+First-order analytical estimate of the cycles of a run
+
+A single pass over the trace builds a profile which does not depend on the
+pipeline configuration: functional unit mix, instruction bytes, fetch
+blocks ended by taken control transfers, branch mispredictions (replayed through the predictors)
+and the distance to the producers of the registers read and written by each
+instruction. Cycles are then estimated for any `issue`, `commit`, `sb_len`
+and `fetch_size` from the profile alone, in well under a millisecond, which
+is enough to discard obviously bad points before running the model.
+
+Issue slots are spent on instructions, on dependency stalls (the producer
+latency not covered by the instructions in between), on refilling the
+instruction queue after mispredictions and on fetch bandwidth. The result
+is bounded by commit bandwidth, the store commit port, functional units and
+scoreboard occupancy (Little's law).
+"""
+
+import sys
+import time
+import argparse
+
+from collections import Counter
+
+from model import Lockstep, read_instructions, print_data, to_fu, Fu, LATENCIES, latency_class
+from isa import Reg
+from predictors import Ras, Btb, make_predictor
+
+# Producers further away never stall in the configurations of interest
+MAX_DISTANCE = 32
+
+# Cycles lost after a misprediction: the instruction queue is flushed until
+# the branch resolves, 6 cycles after its issue (Model.issue_manage_last_branch)
+BMISS_PENALTY = 5.5
+
+def latency(instr):
+    """Cycles between issue and done, with the default latencies of Model"""
+    return LATENCIES[latency_class(instr)]
+
+class TraceProfile:
+    """Configuration independent characteristics of a trace"""
+
+    def __init__(self, instructions, predictor='bimodal', bht_entries=128, btb_entries=0):
+        self.n_instr = 0
+        self.bytes = 0
+        self.fu_mix = Counter()
+        self.stores = 0
+        self.bmiss = 0
+        # Fetch blocks, ended by taken transfers: (instructions, bytes) -> count
+        self.blocks = Counter()
+        # (('RAW' or 'WAW', producer latency, distance), ...) -> count
+        self.dependencies = Counter()
+        self.latencies = Counter()
+
+        bht = make_predictor(predictor, bht_entries)
+        ras = Ras()
+        btb = Btb(btb_entries) if btb_entries > 0 else None
+        writers = {}
+        last = None
+        block = (0, 0)
+        for index, instr in enumerate(instructions):
+            if last is not None:
+                self._control(last, instr, bht, ras, btb)
+                if instr.address != last.next_addr():
+                    self.blocks[block] += 1
+                    block = (0, 0)
+            self.n_instr += 1
+            self.bytes += instr.size()
+            block = (block[0] + 1, block[1] + instr.size())
+            self.fu_mix[to_fu(instr).name] += 1
+            self.stores += instr.is_store()
+            lat = latency(instr)
+            self.latencies[lat] += 1
+            self._dependencies(instr, index, lat, writers)
+            ras.resolve(instr)
+            last = instr
+        if block[0]:
+            self.blocks[block] += 1
+
+    def _dependencies(self, instr, index, lat, writers):
+        fields = instr.fields()
+        found = set()
+        for source in ['rs1', 'rs2']:
+            reg = getattr(fields, source, Reg.zero)
+            if reg != Reg.zero and reg in writers:
+                producer, producer_lat = writers[reg]
+                if index - producer <= MAX_DISTANCE:
+                    found.add(('RAW', producer_lat, index - producer))
+        reg = getattr(fields, 'rd', Reg.zero)
+        if reg != Reg.zero:
+            if reg in writers:
+                producer, producer_lat = writers[reg]
+                if index - producer <= MAX_DISTANCE:
+                    found.add(('WAW', producer_lat, index - producer))
+            writers[reg] = (index, lat)
+        if found:
+            self.dependencies[tuple(sorted(found))] += 1
+
+    def _control(self, last, instr, bht, ras, btb):
+        taken = instr.address != last.next_addr()
+        if last.is_branch():
+            pred = bht.predict(last.address)
+            if pred is None:
+                pred = last.offset() >> 31 != 0
+            if pred != taken:
+                self.bmiss += 1
+            bht.resolve(last.address, taken)
+        elif last.is_regjump():
+            if last.is_ret():
+                target = ras.read()
+            else:
+                target = btb.predict(last.address) if btb is not None else None
+                if btb is not None:
+                    btb.resolve(last.address, instr.address)
+            if target != instr.address:
+                self.bmiss += 1
+
+def fetch_width(issue, fetch_size=None):
+    """Bytes fetched per cycle, as in IqLen"""
+    width = 4
+    while width < (fetch_size or 4 * issue):
+        width <<= 1
+    return width
+
+def dependency_stalls(profile, issue, has_forwarding=True, has_renaming=True):
+    """Issue cycles lost waiting for producers"""
+    # Results are forwarded when done, else read after commit, one cycle later
+    extra = 0 if has_forwarding else 1
+    stalls = 0
+    for dependencies, count in profile.dependencies.items():
+        worst = 0
+        for kind, lat, distance in dependencies:
+            if kind == 'RAW':
+                wait = lat + extra
+            elif not has_renaming:
+                wait = lat + 1
+            else:
+                continue
+            worst = max(worst, wait - distance / issue)
+        stalls += count * worst
+    return stalls
+
+def estimate(profile, issue=1, commit=2, sb_len=8, fetch_size=None,
+             has_forwarding=True, has_renaming=True):
+    """Estimated cycles of Model.run for a configuration"""
+    n = profile.n_instr
+    fetch = fetch_width(issue, fetch_size)
+    # Each block is issued at the issue width or fetched at the fetch width,
+    # plus the fetch cycle lost on the transfer which ends it
+    front = sum(count * max(n_instr / issue, n_bytes / fetch + 1)
+                for (n_instr, n_bytes), count in profile.blocks.items()) \
+        + dependency_stalls(profile, issue, has_forwarding, has_renaming) \
+        + profile.bmiss * BMISS_PENALTY
+    mix = profile.fu_mix
+    alus = 2 if issue > 1 else 1
+    units = max(
+        mix[Fu.LDU.name] + mix[Fu.STU.name],
+        mix[Fu.BRANCH.name],
+        (mix[Fu.ALU.name] + mix[Fu.BRANCH.name] + mix[Fu.MUL.name]) / alus,
+    )
+    # Stores only commit on the first port
+    back = max(n / commit, profile.stores)
+    # Entries stay from issue until the cycle after done
+    occupancy = sum((lat + 1) * count for lat, count in profile.latencies.items()) / sb_len
+    return max(front, units, back, occupancy)
+
+def validate(instructions, profile, configs):
+    """Estimated and simulated cycles of each configuration"""
+    cycles = Lockstep(configs).run(instructions)
+    return [(config, estimate(profile, **config), simulated)
+            for config, simulated in zip(configs, cycles)]
+
+def config_name(config):
+    """Short name of a configuration"""
+    return " ".join(f"{k}={v}" for k, v in config.items())
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", help="RVFI trace")
+    parser.add_argument("--issue", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--commit", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--sb-len", type=int, nargs="+", default=[4, 8])
+    parser.add_argument("--validate", type=int, default=0, metavar="N",
+                        help="simulate every N-th configuration and report the error")
+    args = parser.parse_args(argv)
+
+    instructions = list(read_instructions(args.trace))
+    start = time.time()
+    profile = TraceProfile(instructions)
+    print_data("profile", f"{time.time() - start:.2f}s")
+    configs = [dict(issue=i, commit=c, sb_len=s)
+               for i in args.issue for c in args.commit for s in args.sb_len]
+    start = time.time()
+    estimates = [estimate(profile, **config) for config in configs]
+    print_data("estimates", f"{1000 * (time.time() - start):.2f}ms")
+    for config, cycles in zip(configs, estimates):
+        print_data(config_name(config), f"{cycles:.0f} cycles")
+    if args.validate:
+        errors = []
+        for config, estimated, simulated in validate(
+                instructions, profile, configs[::args.validate]):
+            errors.append(abs(estimated - simulated) / simulated)
+            print_data(config_name(config),
+                       f"{estimated:.0f} estimated, {simulated} simulated "
+                       f"({100 * (estimated - simulated) / simulated:+.1f}%)")
+        print_data("mean error", f"{100 * sum(errors) / len(errors):.1f}%")
+        print_data("max error", f"{100 * max(errors):.1f}%")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
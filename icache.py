@@ -0,0 +1,76 @@
+"""
+Instruction cache model
+
+The cache is accessed each time the instruction stream enters a new line.
+Hit or miss only depends on the sequence of fetched lines, so it can be
+computed for a whole trace before the detailed simulation, or for many
+cache configurations in a single pass over the trace.
+"""
+
+from array import array
+
+class ICache:
+    """Set-associative cache with LRU replacement, tags and ages in arrays"""
+
+    def __init__(self, size=16384, ways=4, line_size=16, miss_latency=10):
+        if line_size < 1 or line_size & (line_size - 1):
+            raise ValueError(f"line size must be a power of 2, not {line_size}")
+        if ways < 1:
+            raise ValueError(f"ways must be at least 1, not {ways}")
+        set_size = ways * line_size
+        if size < set_size or size % set_size:
+            raise ValueError(f"size {size} must be a multiple of ways * line size ({set_size})")
+        self.size = size
+        self.ways = ways
+        self.line_size = line_size
+        self.miss_latency = miss_latency
+        self.sets = size // set_size
+        self.line_bits = line_size.bit_length() - 1
+        self.tags = array('q', [-1]) * (self.sets * ways)
+        self.ages = array('Q', bytes(8 * self.sets * ways))
+        self.clock = 0
+        self.last_line = None
+        self.accesses = 0
+        self.misses = 0
+
+    def access(self, line):
+        """Look up a line, allocate it on a miss. True on a hit"""
+        self.clock += 1
+        self.accesses += 1
+        first = (line % self.sets) * self.ways
+        tags = self.tags
+        for way in range(first, first + self.ways):
+            if tags[way] == line:
+                self.ages[way] = self.clock
+                return True
+        ages = self.ages
+        victim = min(range(first, first + self.ways), key=ages.__getitem__)
+        tags[victim] = line
+        ages[victim] = self.clock
+        self.misses += 1
+        return False
+
+    def fetch(self, address):
+        """Fetch an instruction, True if it starts a line which misses"""
+        line = address >> self.line_bits
+        if line == self.last_line:
+            return False
+        self.last_line = line
+        return not self.access(line)
+
+    def miss_pass(self, instructions):
+        """Instructions waiting for a missing line, in fetch order"""
+        fetch = self.fetch
+        return [instr for instr in instructions if fetch(instr.address)]
+
+    def miss_rate(self):
+        """Ratio of accesses which missed"""
+        return self.misses / self.accesses if self.accesses else 0
+
+def sweep(addresses, caches):
+    """Run the same address stream through several caches"""
+    for cache in caches:
+        fetch = cache.fetch
+        for address in addresses:
+            fetch(address)
+    return caches
@@ -0,0 +1,36 @@
+"""
+Miss rates of instruction caches of several sizes on a trace
+
+The fetched addresses are read once, then run through each cache, see
+`icache.sweep`.
+"""
+
+import sys
+import argparse
+
+from array import array
+
+from icache import ICache, sweep
+from model import read_instructions, print_data
+
+def main(argv):
+    "Entry point: miss rates of several cache sizes on a trace"
+    parser = argparse.ArgumentParser(description="Instruction cache miss rates")
+    parser.add_argument("trace", help="RVFI trace")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2048, 4096, 8192, 16384, 32768],
+                        help="cache sizes in bytes")
+    parser.add_argument("--ways", type=int, default=4)
+    parser.add_argument("--line", type=int, default=16, help="line size in bytes")
+    args = parser.parse_args(argv)
+
+    try:
+        caches = [ICache(size, args.ways, args.line) for size in args.sizes]
+    except ValueError as error:
+        parser.error(str(error))
+    addresses = array('Q', (instr.address for instr in read_instructions(args.trace)))
+    for cache in sweep(addresses, caches):
+        print_data(f"{cache.size} bytes",
+                   f"{cache.misses}/{cache.accesses} misses ({100 * cache.miss_rate():.2f}%)")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
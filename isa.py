@@ -470,6 +470,8 @@ class Instr:
     loads = iloads + floads
     stores = istores + fstores
 
+    __slots__ = ('bin', 'inst_1_0')
+
     def __init__(self, bincode):
         self.bin = bincode
         self.inst_1_0 = self.bin & 3
@@ -527,6 +529,10 @@ class Instr:
         """Is it a muldiv instruction?"""
         return self.base() in ['OP', 'OP-32'] and self.fields().funct7 == 1
 
+    def is_div(self):
+        """Is it a division or a remainder?"""
+        return self.is_muldiv() and self.fields().funct3 >= 4
+
     def offset(self):
         """Get offset from instr (sometimes it is just 'imm' in RISCV spec)"""
         fields = self.fields()
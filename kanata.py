@@ -0,0 +1,135 @@
+"""
+Pipeline view in the Kanata log format of the Konata viewer
+
+Instructions appear when the first event is logged on them: they wait in
+stage `Is` while the head of the queue has hazards, then execute in `Ex`
+from issue until done, and wait in `Cm` until commit. Hazards and branch
+prediction events are shown as labels.
+
+The log is written while the model runs. Every `interval` cycles, the
+position in the file and the instructions in flight are stored in an index
+next to it (`<log>.idx`), so that a window of cycles can be extracted as a
+valid log without reading the file from the beginning.
+"""
+
+import sys
+import json
+import bisect
+import argparse
+
+STAGES = {'issue': 'Ex', 'done': 'Cm'}
+
+class KanataWriter:
+    """Writes events of a model run as a Kanata log, with a checkpoint index"""
+
+    def __init__(self, path, interval=1000, buffer_size=1 << 20):
+        self.file = open(path, "wb", buffering=buffer_size)
+        self.index = open(path + ".idx", "w", encoding="utf8")
+        self.interval = interval
+        self.next_checkpoint = 0
+        self.cycle = None
+        self.n_instr = 0
+        self.n_retired = 0
+        # Instructions in flight by id: Kanata id, lines written, current stage
+        self.in_flight = {}
+        self._write("Kanata\t0004\n")
+
+    def _write(self, text):
+        self.file.write(text.encode("utf8"))
+
+    def _advance(self, cycle):
+        if self.cycle is None:
+            self._write(f"C=\t{cycle}\n")
+        elif cycle > self.cycle:
+            self._write(f"C\t{cycle - self.cycle}\n")
+        self.cycle = cycle
+        if cycle >= self.next_checkpoint:
+            self._checkpoint(cycle)
+            self.next_checkpoint = cycle - cycle % self.interval + self.interval
+
+    def _checkpoint(self, cycle):
+        prologue = "".join("".join(lines) + f"S\t{kid}\t0\t{stage}\n"
+                           for kid, lines, stage in self.in_flight.values())
+        self.index.write(json.dumps([cycle, self.file.tell(), prologue]) + "\n")
+
+    def event(self, instr, event):
+        """Event subscriber, for events of all kinds"""
+        self._advance(event.cycle)
+        kind = event.kind.name
+        state = self.in_flight.get(id(instr))
+        if state is None:
+            kid = self.n_instr
+            self.n_instr += 1
+            lines = [f"I\t{kid}\t{kid}\t0\n",
+                     f"L\t{kid}\t0\t{instr.address:08x}: {instr.mnemo}\n"]
+            self._write("".join(lines))
+            stage = 'Is' if kind != 'issue' else 'Ex'
+            self._write(f"S\t{kid}\t0\t{stage}\n")
+            state = self.in_flight[id(instr)] = [kid, lines, stage]
+            if kind == 'issue':
+                return
+        kid, lines, stage = state
+        if kind in STAGES:
+            self._write(f"E\t{kid}\t0\t{stage}\nS\t{kid}\t0\t{STAGES[kind]}\n")
+            state[2] = STAGES[kind]
+        elif kind == 'commit':
+            self._write(f"E\t{kid}\t0\t{stage}\nR\t{kid}\t{self.n_retired}\t0\n")
+            self.n_retired += 1
+            del self.in_flight[id(instr)]
+        else:
+            # Labels of an instruction are concatenated by the viewer
+            label = f"L\t{kid}\t1\t{kind}@{event.cycle} \n"
+            lines.append(label)
+            self._write(label)
+
+    def close(self):
+        """Flush and close the log and its index"""
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def attach(model, path, interval=1000):
+    """Write the pipeline view of a model run to path, returns the writer"""
+    writer = KanataWriter(path, interval)
+    model.subscribe(writer.event)
+    model.subscribe_end(lambda model, n_cycles: writer.close())
+    return writer
+
+def read_index(path):
+    """Checkpoints of a log: cycles, file offsets and prologues"""
+    with open(path + ".idx", encoding="utf8") as file:
+        return [json.loads(line) for line in file]
+
+def extract(path, start, end, output):
+    """Write the cycles [start, end] of a log as a log, starting at the
+    checkpoint before start"""
+    checkpoints = read_index(path)
+    cycles = [c[0] for c in checkpoints]
+    cycle, offset, prologue = checkpoints[max(bisect.bisect_right(cycles, start) - 1, 0)]
+    with open(path, "rb") as log, open(output, "wb") as out:
+        out.write(f"Kanata\t0004\nC=\t{cycle}\n{prologue}".encode("utf8"))
+        log.seek(offset)
+        for line in log:
+            if line.startswith(b"C\t"):
+                cycle += int(line[2:])
+                if cycle > end:
+                    break
+            out.write(line)
+
+def main(argv):
+    "Entry point: extract a window of cycles"
+    parser = argparse.ArgumentParser(description="Extract cycles of a Kanata log")
+    parser.add_argument("log", help="Kanata log written by the model")
+    parser.add_argument("start", type=int, help="first cycle")
+    parser.add_argument("end", type=int, help="last cycle")
+    parser.add_argument("-o", "--output", default="window.kanata")
+    args = parser.parse_args(argv)
+    extract(args.log, args.start, args.end, args.output)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
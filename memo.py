@@ -0,0 +1,141 @@
+"""
+Memoization of the steady state of loops
+
+At the end of each cycle in which a backward branch committed, the state of
+the model is hashed. When a state recurs, the instructions issued since its
+previous occurrence form a period of the pipeline behavior: if the next
+instructions of the trace repeat them, simulating them would lead back to
+the same state, after the same number of cycles and with the same events.
+The period is then skipped, as many times as the trace repeats it.
+"""
+
+import sys
+import time
+import argparse
+
+from collections import Counter
+
+from model import Model, EventKind, decode, print_data
+
+class LoopMemo:
+    """Skips periods of a model run, keeping exact cycle and event counts"""
+
+    def __init__(self, event_kinds, max_states=4096, max_period=4096):
+        """event_kinds: the Enum of events logged by the model"""
+        self.event_kinds = list(event_kinds)
+        self.max_states = max_states
+        self.max_period = max_period
+        self.counts = [0] * len(self.event_kinds)
+        self.issued = []
+        self.n_issued = 0
+        self.states = {}
+        self.loop_back = False
+        self.skipped_periods = 0
+        self.skipped_instructions = 0
+        self.skipped_cycles = 0
+
+    def event(self, instr, event):
+        """Event subscriber, counts events by kind"""
+        self.counts[event.kind.value - 1] += 1
+
+    def issue(self, instr, event):
+        """Issue event subscriber"""
+        self.issued.append((instr.address, instr.bin))
+        self.n_issued += 1
+
+    def commit(self, instr, event):
+        """Commit event subscriber, looks for backward branches"""
+        if decode(instr).backward:
+            self.loop_back = True
+
+    def cycle(self, model, cycle):
+        """Hash the state after a loop back, skip periods if it recurs"""
+        if not self.loop_back:
+            return
+        self.loop_back = False
+        signature = model.state_signature(cycle)
+        seen = self.states.get(signature)
+        if seen is not None:
+            first_cycle, first_issued, first_counts = seen
+            period = self.n_issued - first_issued
+            n_cycles = cycle - first_cycle
+            counts = [n - first for n, first in zip(self.counts, first_counts)]
+            while 0 < period <= self.max_period and self._repeats(model.instr_queue, period):
+                self.issued.extend(self.issued[-period:])
+                model.skip(period, n_cycles)
+                cycle += n_cycles
+                self.n_issued += period
+                self.counts = [n + delta for n, delta in zip(self.counts, counts)]
+                self.skipped_periods += 1
+                self.skipped_instructions += period
+                self.skipped_cycles += n_cycles
+        if len(self.states) >= self.max_states:
+            self.states.clear()
+        self.states[signature] = (cycle, self.n_issued, list(self.counts))
+        if len(self.issued) > 2 * self.max_period:
+            del self.issued[:-self.max_period]
+
+    def _repeats(self, queue, period):
+        """Are the next period + 1 instructions the last period ones and the head?
+
+        The head of the queue is the last instruction the model looked at."""
+        if len(queue) <= period or len(self.issued) < period:
+            return False
+        last = self.issued[-period:]
+        for i in range(period + 1):
+            instr = queue[i]
+            previous = last[i] if i < period else (queue[0].address, queue[0].bin)
+            if (instr.address, instr.bin) != previous:
+                return False
+        return True
+
+    def summary(self):
+        """Event counts by name"""
+        return {kind.name: count for kind, count in zip(self.event_kinds, self.counts) if count}
+
+def attach(model):
+    """Skip the loop iterations of a model run which repeat exactly, returns
+    the memoizer
+
+    Cycles and the event counts of the memoizer stay exact, but other
+    subscribers do not see the skipped instructions."""
+    if model.icache is not None or model.roi is not None:
+        raise ValueError("memoization does not support instruction caches "
+                         "and regions of interest")
+    memo = LoopMemo(EventKind)
+    model.subscribe(memo.event)
+    model.subscribe(memo.issue, [EventKind.issue])
+    model.subscribe(memo.commit, [EventKind.commit])
+    model.subscribe_cycles(memo.cycle)
+    return memo
+
+def main(argv):
+    "Entry point: compare a memoized run with a detailed one"
+    parser = argparse.ArgumentParser(description="Loop memoization check")
+    parser.add_argument("trace", help="RVFI trace")
+    parser.add_argument("--issue", type=int, default=2)
+    parser.add_argument("--commit", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    results = []
+    for memoize in [False, True]:
+        model = Model(issue=args.issue, commit=args.commit, keep_retired=False, keep_log=False,
+                      record_events=False)
+        model.load_file(args.trace)
+        if memoize:
+            memo = attach(model)
+        else:
+            counts = Counter()
+            model.subscribe(lambda instr, event: counts.update([event.kind.name]))
+        start = time.time()
+        cycles = model.run()
+        elapsed = time.time() - start
+        results.append((cycles, memo.summary() if memoize else dict(counts)))
+        print_data("memoized" if memoize else "detailed", f"{cycles} cycles in {elapsed:.2f}s")
+        if memoize:
+            print_data("skipped", f"{memo.skipped_instructions} instructions, "
+                       f"{memo.skipped_cycles} cycles in {memo.skipped_periods} periods")
+    print_data("identical", results[0] == results[1])
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,152 @@
+"""
+Memory accounting of the model data structures
+
+Every `interval` cycles and at the end of the run, the instructions and
+bytes held by each structure of the model are estimated from the sizes of
+a sample of their elements, and the memory traced by `tracemalloc` is
+recorded. At the end, a snapshot attributes the traced memory to the
+source lines which allocated it.
+
+Trace text and mnemonics are shared by instructions and not counted.
+"""
+
+import sys
+import tracemalloc
+
+from model import EventKind, run_stats as model_stats
+
+# Elements whose size is measured in each structure
+SAMPLES = 64
+
+def object_size(obj):
+    """Bytes of an object and of its attribute dictionary, if any"""
+    size = sys.getsizeof(obj)
+    attributes = getattr(obj, "__dict__", None)
+    if attributes is not None:
+        size += sys.getsizeof(attributes)
+    return size
+
+def sampled_total(items, measure):
+    """Sum of a measure over the elements of a sequence, estimated on a sample"""
+    if not items:
+        return 0
+    sample = items[::max(len(items) // SAMPLES, 1)]
+    return round(len(items) * sum(measure(e) for e in sample) / len(sample))
+
+def sampled_size(items, element_size):
+    """Bytes of a sequence and of its elements"""
+    return sys.getsizeof(items) + sampled_total(items, element_size)
+
+def events_size(instr):
+    """Bytes of the events recorded on an instruction"""
+    if not instr.events:
+        # Shared empty tuple
+        return 0
+    return sys.getsizeof(instr.events) + sum(object_size(e) for e in instr.events)
+
+def structure_sizes(model):
+    """(count, bytes) of each structure of a model"""
+    # Instructions issued and not committed are only referenced by the scoreboard
+    held = [model.instr_queue, [e.instr for e in model.scoreboard], model.retired]
+    # Events of the log are counted with the instructions, if recorded on them
+    event_size = (lambda event: 0) if model.record_events else object_size
+    return {
+        "instr_queue": (len(model.instr_queue), sampled_size(model.instr_queue, object_size)),
+        "scoreboard": (len(model.scoreboard), sampled_size(
+            model.scoreboard, lambda e: object_size(e) + object_size(e.instr))),
+        "retired": (len(model.retired), sampled_size(model.retired, object_size)),
+        "log": (len(model.log), sampled_size(
+            model.log, lambda item: sys.getsizeof(item) + event_size(item[0]))),
+        "events": (sum(sampled_total(instrs, lambda i: len(i.events)) for instrs in held),
+                   sum(sampled_total(instrs, events_size) for instrs in held)),
+        "icache_misses": (len(model.icache_misses), sys.getsizeof(model.icache_misses)),
+    }
+
+class MemoryStats:
+    """Structure sizes and traced memory every interval cycles"""
+
+    def __init__(self, interval=100000):
+        self.interval = interval
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.n_committed = 0
+        # (cycle, committed instructions, traced bytes, structure sizes)
+        self.samples = []
+        self.peak = 0
+        self.top_lines = []
+
+    def commit(self, instr, event):
+        """Commit event subscriber"""
+        self.n_committed += 1
+
+    def cycle(self, model, cycle):
+        """Sample the structures every interval cycles"""
+        if cycle % self.interval == 0:
+            self.sample(model, cycle)
+
+    def sample(self, model, cycle):
+        """Record the sizes of the structures of a model"""
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        self.samples.append((cycle, self.n_committed, current, structure_sizes(model)))
+
+    def end(self, model, n_cycles):
+        """End of run subscriber: last sample and allocation sites"""
+        self.sample(model, n_cycles)
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)])
+        self.top_lines = [(str(stat.traceback), stat.size, stat.count)
+                          for stat in snapshot.statistics("lineno")[:10]]
+        if self.started_tracing:
+            tracemalloc.stop()
+
+    def peak_per_million(self):
+        """Peak traced bytes per million committed instructions"""
+        return round(1000000 * self.peak / max(self.n_committed, 1))
+
+    def summary(self):
+        """Peak memory and the sizes of the structures at the end"""
+        _, _, current, sizes = self.samples[-1]
+        return {
+            "peak_bytes": self.peak,
+            "peak_bytes_per_minstr": self.peak_per_million(),
+            "final_bytes": current,
+            "structures": {name: {"count": count, "bytes": size}
+                           for name, (count, size) in sizes.items()},
+        }
+
+    def report(self):
+        """Print the samples, then the largest allocation sites"""
+        names = list(self.samples[0][3]) if self.samples else []
+        print(f"{'cycle':>10} {'commits':>10} {'traced':>10} "
+              + " ".join(f"{name:>14}" for name in names))
+        for cycle, n_committed, current, sizes in self.samples:
+            print(f"{cycle:>10} {n_committed:>10} {megabytes(current):>10} "
+                  + " ".join(f"{megabytes(sizes[name][1]):>14}" for name in names))
+        print(f"peak {megabytes(self.peak)}, {megabytes(self.peak_per_million())} "
+              "per million instructions")
+        for site, size, count in self.top_lines:
+            print(f"  {megabytes(size):>10} in {count:>8} blocks at {site}")
+
+def megabytes(size):
+    """Human-readable size in MiB"""
+    return f"{size / (1 << 20):.2f}M"
+
+def attach(model, interval=100000):
+    """Sample the memory held by the structures of a model run, returns the recorder"""
+    recorder = MemoryStats(interval)
+    model.subscribe(recorder.commit, [EventKind.commit])
+    model.subscribe_cycles(recorder.cycle)
+    model.subscribe_end(recorder.end)
+    return recorder
+
+def run_stats(instructions, interval=100000, **params):
+    """Statistics of the timed part of a run, as model.run_stats, with the
+    summary of memory samples taken every interval cycles"""
+    recorders = []
+    stats = model_stats(
+        instructions, attach=lambda model: recorders.append(attach(model, interval)), **params)
+    stats["memory"] = recorders[0].summary()
+    return stats
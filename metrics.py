@@ -0,0 +1,172 @@
+"""
+Pipeline metrics: time series sampled over windows of cycles, CPI stacks
+"""
+
+import sys
+import zipfile
+
+from array import array
+from collections import defaultdict
+
+from model import EventKind
+
+class WindowedMetrics:
+    """Per-window IPC, occupancies, FU busy fractions and event rates
+
+    Values are accumulated every cycle and stored when a window closes, in
+    preallocated ring buffers: only the last `capacity` windows are kept."""
+
+    fus = ['alu', 'mul', 'branch', 'ldu', 'stu', 'alu2']
+
+    def __init__(self, event_kinds, window=1000, capacity=1 << 16):
+        """event_kinds: the Enum of events logged by the model"""
+        self.window = window
+        self.capacity = capacity
+        self.event_kinds = list(event_kinds)
+        self.commit_index = event_kinds['commit'].value - 1
+        self.columns = ['cycle', 'ipc', 'sb_occupancy', 'iq_len'] \
+            + [f"{fu}_busy" for fu in WindowedMetrics.fus] \
+            + [f"{kind.name}_per_instr" for kind in self.event_kinds]
+        self.buffers = [array('d', bytes(8 * capacity)) for _ in self.columns]
+        self.n_windows = 0
+        self._reset()
+
+    def _reset(self):
+        self.cycles = 0
+        self.sb_sum = 0
+        self.iq_sum = 0
+        self.busy = [0] * len(WindowedMetrics.fus)
+        self.counts = [0] * len(self.event_kinds)
+
+    def event(self, instr, event):
+        """Event subscriber, counts events by kind"""
+        self.counts[event.kind.value - 1] += 1
+
+    def cycle(self, model, cycle):
+        """Accumulate the state of the model at the end of a cycle"""
+        self.cycles += 1
+        self.sb_sum += len(model.scoreboard)
+        self.iq_sum += model.iqlen.len
+        fus = model.fus
+        busy = self.busy
+        busy[0] += fus.alu
+        busy[1] += fus.mul
+        busy[2] += fus.branch
+        busy[3] += fus.ldu
+        busy[4] += fus.stu
+        busy[5] += fus.alu2
+        if self.cycles == self.window:
+            self.close(cycle)
+
+    def close(self, cycle):
+        """Store the current window, ending at cycle"""
+        if self.cycles == 0:
+            return
+        committed = self.counts[self.commit_index]
+        values = [
+            cycle,
+            committed / self.cycles,
+            self.sb_sum / self.cycles,
+            self.iq_sum / self.cycles,
+        ] + [b / self.cycles for b in self.busy] \
+          + [c / committed if committed else 0 for c in self.counts]
+        slot = self.n_windows % self.capacity
+        for buffer, value in zip(self.buffers, values):
+            buffer[slot] = value
+        self.n_windows += 1
+        self._reset()
+
+    def rows(self):
+        """Stored windows, oldest first"""
+        n = min(self.n_windows, self.capacity)
+        first = self.n_windows - n
+        for i in range(first, self.n_windows):
+            slot = i % self.capacity
+            yield [buffer[slot] for buffer in self.buffers]
+
+    def write_csv(self, path):
+        """Write windows as CSV"""
+        with open(path, "w", encoding="utf8") as file:
+            file.write(",".join(self.columns) + "\n")
+            for row in self.rows():
+                file.write(",".join(f"{v:g}" for v in row) + "\n")
+
+    def write_npz(self, path):
+        """Write one array per column in NumPy's .npz format"""
+        n = min(self.n_windows, self.capacity)
+        first = self.n_windows % self.capacity if self.n_windows > self.capacity else 0
+        with zipfile.ZipFile(path, "w") as archive:
+            for name, buffer in zip(self.columns, self.buffers):
+                ordered = buffer[first:n] + buffer[:first] if first else buffer[:n]
+                archive.writestr(f"{name}.npy", npy_bytes(ordered))
+
+    def write(self, path):
+        """Write windows as .npz or CSV depending on the extension"""
+        if path.endswith(".npz"):
+            self.write_npz(path)
+        else:
+            self.write_csv(path)
+
+def npy_bytes(values):
+    """A 1D array('d') in NumPy's .npy format (version 1.0)"""
+    endian = '<' if sys.byteorder == 'little' else '>'
+    header = f"{{'descr': '{endian}f8', 'fortran_order': False, 'shape': ({len(values)},), }}"
+    # Magic, version and header length take 10 bytes, data is 64-byte aligned
+    padding = -(10 + len(header) + 1) % 64
+    header = header + " " * padding + "\n"
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") \
+        + header.encode("latin1") + values.tobytes()
+
+def attach(model, window=1000):
+    """Record windowed metrics during a model run, returns the recorder"""
+    recorder = WindowedMetrics(EventKind, window)
+    model.subscribe(recorder.event)
+    model.subscribe_cycles(recorder.cycle)
+    model.subscribe_end(lambda model, n_cycles: recorder.close(n_cycles - 1))
+    return recorder
+
+class CpiStack:
+    """Attributes every issue and commit slot of every cycle to one cause
+
+    A slot is either used ('base') or lost for the first reason found. Slot
+    counts divided by the width give cycles, which sum to the cycle count."""
+
+    def __init__(self, issue_width, commit_width):
+        self.issue_width = issue_width
+        self.commit_width = commit_width
+        self.issue = defaultdict(int)
+        self.commit = defaultdict(int)
+
+    def issue_slot(self, stall):
+        """Account an issue slot, stall is None if an instruction issued"""
+        self.issue[stall or 'base'] += 1
+
+    def commit_slot(self, stall):
+        """Account a commit slot, stall is None if an instruction committed"""
+        self.commit[stall or 'base'] += 1
+
+    def cycles(self, stage):
+        """Cycles per cause for 'issue' or 'commit', largest first"""
+        slots, width = {
+            'issue': (self.issue, self.issue_width),
+            'commit': (self.commit, self.commit_width),
+        }[stage]
+        stack = {cause: count / width for cause, count in slots.items()}
+        return dict(sorted(stack.items(), key=lambda c: -c[1]))
+
+    def report(self, n_instr):
+        """Print both stacks, in cycles and in cycles per instruction"""
+        for stage in ['issue', 'commit']:
+            stack = self.cycles(stage)
+            total = sum(stack.values())
+            print(f"{stage} CPI stack")
+            for cause, cycles in stack.items():
+                print(f"  {cause:<24} = {cycles:.1f} cycles, "
+                      f"CPI {cycles / n_instr:.3f} ({100 * cycles / total:.2f}%)")
+            print(f"  {'total':<24} = {total:.1f} cycles, CPI {total / n_instr:.3f}")
+
+def attach_cpi_stack(model):
+    """Attribute the issue and commit slots of a model run to stall causes,
+    returns the recorder"""
+    model.cpi = CpiStack(model.issue_width, model.commit_width)
+    return model.cpi
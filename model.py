@@ -2,16 +2,31 @@
 Performance model of the cva6
 """
 
+import os
 import sys
 import re
+import mmap
+import stat
+import time
+import queue
+import inspect
+import itertools
+import threading
 
 from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
 from collections import defaultdict
 
 #from matplotlib import pyplot as plt
 
 from isa import Instr, Reg
+from predictors import Ras, Btb, make_predictor
+from result_cache import ResultCache
+from roi import re_csrr_minstret
+from icache import ICache
+from trace_index import open_index
+from parallel_parse import Groups, parse_parallel
 
 EventKind = Enum('EventKind', [
     'WAW', 'WAR', 'RAW',
@@ -35,16 +50,69 @@ class Event:
     def __repr__(self):
         return f"@{self.cycle}: {self.kind}"
 
+class TraceText:
+    """Read-only memory-mapped view of a trace file"""
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def line(self, offset, length):
+        """Text of a line from its position in the file"""
+        return self.view[offset:offset + length].decode("utf8")
+
+    def release(self, offset):
+        """Lines of a file stay readable"""
+
+class StreamText:
+    """Lines of a trace read from a stream, kept in memory until released"""
+    def __init__(self):
+        self.data = bytearray()
+        # Position in the stream of the first byte kept
+        self.base = 0
+
+    def keep(self, raw_lines):
+        """Store lines while iterating over them"""
+        for raw in raw_lines:
+            self.data += raw
+            yield raw
+
+    def line(self, offset, length):
+        """Text of a line from its position in the stream"""
+        if offset < self.base:
+            raise ValueError("line of a committed instruction read after it was released")
+        start = offset - self.base
+        return self.data[start:start + length].decode("utf8")
+
+    def release(self, offset):
+        """Forget the stream before a position"""
+        if offset > self.base:
+            del self.data[:offset - self.base]
+            self.base = offset
+
 class Instruction(Instr):
-    """Represents a RISC-V instruction with annotations"""
+    """Represents a RISC-V instruction with annotations
+
+    The line of the trace is not kept in memory, only its position in the
+    trace file: it is read back when needed."""
+
+    __slots__ = ('address', 'mnemo', 'events', 'text', 'line_offset', 'line_length')
+
+    # Shared by instructions without events, see Model.log_event_on
+    no_events = ()
 
-    def __init__(self, line, address, hex_code, mnemo):
-        Instr.__init__(self, int(hex_code, base=16))
-        self.line = line
-        self.address = int(address, base=16)
-        self.hex_code = hex_code
+    def __init__(self, text, line_offset, line_length, address, bincode, mnemo):
+        Instr.__init__(self, bincode)
+        self.text = text
+        self.line_offset = line_offset
+        self.line_length = line_length
+        self.address = address
         self.mnemo = mnemo
-        self.events = []
+        self.events = Instruction.no_events
+
+    @property
+    def line(self):
+        """The line of the trace"""
+        return self.text.line(self.line_offset, self.line_length)
 
     def mnemo_name(self):
         """The name of the instruction (fisrt word of the mnemo)"""
@@ -79,13 +147,13 @@ class Instruction(Instr):
 class Entry:
     """A scoreboard entry"""
     instr: Instruction
-    cycles_since_issue = 0
+    done_cycle: int = 0
     done: bool = False
 
     def __repr__(self):
         status = "DONE" if self.done else "WIP "
         addr = f"0x{self.instr.address:08X}"
-        return f"{status} {addr}:`{self.instr}` for {self.cycles_since_issue}"
+        return f"{status} {addr}:`{self.instr}` until {self.done_cycle}"
 
 @dataclass
 class LastIssue:
@@ -102,9 +170,16 @@ class IqLen:
         self.debug = debug
         self.len = self.fetch_size
         self.new_fetch = True
+        self.refilling = False
+        self.missing = False
+        self.stall_cycles = 0
 
     def fetch(self):
         """Fetch bytes"""
+        if self.stall_cycles > 0:
+            self.stall_cycles -= 1
+            self._debug(f"waiting for the cache, {self.stall_cycles} cycles left")
+            return
         self.len += self.fetch_size
         self._debug(f"fetched {self.fetch_size}, got {self.len}")
         self.new_fetch = True
@@ -114,6 +189,15 @@ class IqLen:
         self.len = 0
         self._debug(f"flushed, got {self.len}")
         self.new_fetch = False
+        self.refilling = True
+
+    def miss(self, latency):
+        """Instruction cache miss: drop what follows and wait for the line"""
+        self.len = 0
+        self.new_fetch = False
+        self.missing = True
+        self.stall_cycles = latency
+        self._debug(f"cache miss, waiting {latency} cycles")
 
     def jump(self):
         """Loose a fetch cycle and truncate (jump, branch hit taken)"""
@@ -124,28 +208,30 @@ class IqLen:
         self._truncate()
         self._debug(f"jumped, got {self.len}")
 
-    def has(self, instr):
-        """Does the instruction queue have this instruction?"""
+    def has(self, instr, d):
+        """Does the instruction queue have this instruction (decoded as d)?"""
         length = self.len
-        if self._is_crossword(instr):
+        if self._is_crossword(instr, d):
             length -= (self.fetch_size - 2)
-        self._debug(f"comparing {length} to {instr.size()} ({instr})")
-        return length >= instr.size()
-
-    def remove(self, instr):
-        """Remove instruction from queue"""
-        self.len -= instr.size()
-        self._debug(f"removed {instr.size()}, got {self.len}")
-        self._truncate(self._addr_index(instr.next_addr()))
-        if instr.is_jump():
+        self._debug(f"comparing {length} to {d.size} ({instr})")
+        return length >= d.size
+
+    def remove(self, instr, d):
+        """Remove instruction (decoded as d) from queue"""
+        self.len -= d.size
+        self._debug(f"removed {d.size}, got {self.len}")
+        self.refilling = False
+        self.missing = False
+        self._truncate(self._addr_index(instr.address + d.size))
+        if d.is_jump:
             self.jump()
 
     def _addr_index(self, addr):
         return addr & (self.fetch_size - 1)
 
-    def _is_crossword(self, instr):
+    def _is_crossword(self, instr, d):
         is_last = self._addr_index(instr.address) == self.fetch_size - 2
-        return is_last and not instr.is_compressed()
+        return is_last and not d.is_compressed
 
     def _truncate(self, index=0):
         occupancy = self.fetch_size - self._addr_index(self.len)
@@ -159,89 +245,6 @@ class IqLen:
         if self.debug:
             print(f"iq: {message}")
 
-class Ras:
-    "Return Address Stack"
-    def __init__(self, depth=2, debug=False):
-        self.depth = depth - 1
-        self.stack = []
-        self.debug = debug
-        self.last_dropped = None
-
-    def push(self, addr):
-        "Push an address on the stack, forget oldest entry if full"
-        self.stack.append(addr)
-        self._debug(f"pushed 0x{addr:08X}")
-        if len(self.stack) > self.depth:
-            self.stack.pop(0)
-            self._debug("overflown")
-
-    def drop(self):
-        "Drop an address from the stack"
-        self._debug("dropping")
-        if len(self.stack) > 0:
-            self.last_dropped = self.stack.pop()
-        else:
-            self.last_dropped = None
-            self._debug("was already empty")
-
-    def read(self):
-        "Read the top of the stack without modifying it"
-        self._debug("reading")
-        if self.last_dropped is not None:
-            addr = self.last_dropped
-            self._debug(f"read 0x{addr:08X}")
-            return addr
-        self._debug("was empty")
-        return None
-
-    def resolve(self, instr):
-        "Push or pop depending on the instruction"
-        self._debug(f"issuing {instr}")
-        if instr.is_ret():
-            self._debug("detected ret")
-            self.drop()
-        if instr.is_call():
-            self._debug("detected call")
-            self.push(instr.next_addr())
-
-    def _debug(self, message):
-        if self.debug:
-            print(f"RAS: {message}")
-
-class Bht:
-    "Branch History Table"
-
-    @dataclass
-    class Entry:
-        "A BTB entry"
-        valid: bool = False
-        sat_counter: int = 0
-
-    def __init__(self, entries=128):
-        self.contents = [Bht.Entry() for _ in range(entries)]
-
-    def predict(self, addr):
-        "Is the branch taken? None if don't know"
-        entry = self.contents[self._index(addr)]
-        if entry.valid:
-            return entry.sat_counter >= 2
-        return None
-
-    def resolve(self, addr, taken):
-        "Update branch prediction"
-        index = self._index(addr)
-        entry = self.contents[index]
-        entry.valid = True
-        if taken:
-            if entry.sat_counter < 3:
-                entry.sat_counter += 1
-        else:
-            if entry.sat_counter > 0:
-                entry.sat_counter -= 1
-
-    def _index(self, addr):
-        return (addr >> 1) % len(self.contents)
-
 Fu = Enum('Fu', ['ALU', 'MUL', 'BRANCH', 'LDU', 'STU'])
 
 # We have
@@ -261,6 +264,65 @@ def to_fu(instr):
         return Fu.STU
     return Fu.ALU
 
+# Cycles from issue to done of each class of instructions
+LATENCIES = {'alu': 1, 'branch': 1, 'load': 2, 'store': 2, 'mul': 2, 'div': 2}
+
+def latency_class(instr):
+    """Key of an instruction in a latency table"""
+    if instr.is_load():
+        return 'load'
+    if instr.is_store():
+        return 'store'
+    if instr.is_muldiv():
+        return 'div' if instr.is_div() else 'mul'
+    if instr.is_branch() or instr.is_regjump():
+        return 'branch'
+    return 'alu'
+
+class Decoded:
+    """What the pipeline needs to know about a static instruction"""
+
+    __slots__ = ('fu', 'fu_index', 'kind', 'size', 'is_compressed', 'is_store', 'is_muldiv',
+                 'is_div', 'is_branch', 'is_regjump', 'is_jump', 'is_ret', 'is_call', 'writes',
+                 'reads', 'taken_offset', 'backward', 'struct_stall')
+
+    def __init__(self, instr):
+        self.fu = to_fu(instr)
+        self.fu_index = self.fu.value - 1
+        self.kind = latency_class(instr)
+        self.size = instr.size()
+        self.is_compressed = instr.is_compressed()
+        self.is_store = instr.is_store()
+        self.is_muldiv = instr.is_muldiv()
+        self.is_div = instr.is_div()
+        self.is_branch = instr.is_branch()
+        self.is_regjump = instr.is_regjump()
+        self.is_jump = instr.is_jump()
+        self.is_ret = self.is_regjump and instr.is_ret()
+        self.is_call = instr.is_call()
+        fields = instr.fields()
+        # As in Instr.has_RAW_from and has_WAW_from
+        rd = getattr(fields, 'rd', Reg.zero)
+        self.writes = None if rd == Reg.zero else rd
+        self.reads = tuple(getattr(fields, rs) for rs in ['rs1', 'rs2'] if hasattr(fields, rs))
+        self.taken_offset = 0
+        self.backward = False
+        if self.is_branch:
+            offset = instr.offset()
+            self.taken_offset = to_signed(offset)
+            self.backward = offset >> 31 != 0
+        self.struct_stall = f"STRUCT_{self.fu.name}"
+
+# Decoded static instructions by code, shared by all the models
+decoded = {}
+
+def decode(instr):
+    """Decoded entry of an instruction, see Decoded"""
+    entry = decoded.get(instr.bin)
+    if entry is None:
+        entry = decoded[instr.bin] = Decoded(instr)
+    return entry
+
 class FusBusy:
     "Is each functional unit busy"
     def __init__(self, has_alu2 = False):
@@ -287,17 +349,14 @@ class FusBusy:
             Fu.STU: not self.stu,
         }[fu]
 
-    def is_ready_for(self, instr):
-        return self.is_ready(to_fu(instr))
-
-    def issue(self, instr):
+    def issue(self, fu):
         return {
             Fu.ALU: FusBusy.issue_alu,
             Fu.MUL: FusBusy.issue_mul,
             Fu.BRANCH: FusBusy.issue_branch,
             Fu.LDU: FusBusy.issue_ldu,
             Fu.STU: FusBusy.issue_stu,
-        }[to_fu(instr)](self)
+        }[fu](self)
 
     def issue_mul(self):
         self.mul = True
@@ -338,7 +397,7 @@ class Model:
     """Models the scheduling of CVA6"""
 
     re_instr = re.compile(
-        r"([a-z]+)\s+0:\s*0x00000000([0-9a-f]+)\s*\(([0-9a-fx]+)\)\s*@\s*([0-9]+)\s*(.*)"
+        r"([a-z]+)\s+([0-9]+):\s*0x00000000([0-9a-f]+)\s*\(([0-9a-fx]+)\)\s*@\s*([0-9]+)\s*(.*)"
     )
 
     def __init__(
@@ -349,9 +408,38 @@ class Model:
             sb_len=8,
             fetch_size=None,
             has_forwarding=True,
-            has_renaming=True):
+            has_renaming=True,
+            predictor='bimodal',
+            bht_entries=128,
+            btb_entries=0,
+            icache_size=0,
+            icache_ways=4,
+            icache_line=16,
+            icache_latency=10,
+            latencies=None,
+            pipelined_div=True,
+            keep_retired=True,
+            keep_log=True,
+            record_events=True):
         self.ras = Ras(debug=debug)
-        self.bht = Bht()
+        self.bht = make_predictor(predictor, bht_entries)
+        self.btb = Btb(btb_entries) if btb_entries > 0 else None
+        self.icache = None
+        if icache_size > 0:
+            self.icache = ICache(icache_size, icache_ways, icache_line, icache_latency)
+        self.icache_misses = set()
+        self.icache_ahead = False
+        unknown = set(latencies or {}) - set(LATENCIES)
+        if unknown:
+            known = ", ".join(LATENCIES)
+            raise ValueError(f"unknown latency class {', '.join(sorted(unknown))} (known: {known})")
+        self.latencies = {**LATENCIES, **(latencies or {})}
+        if min(self.latencies.values()) < 1:
+            raise ValueError("latencies must be at least 1 cycle")
+        self.pipelined_div = pipelined_div
+        self.div_busy_until = 0
+        # Entries by done cycle, modulo the longest latency + 1
+        self.wheel = [[] for _ in range(max(self.latencies.values()) + 1)]
         self.instr_queue = []
         self.scoreboard = []
         self.fus = FusBusy(issue > 1)
@@ -366,52 +454,100 @@ class Model:
         self.has_forwarding = has_forwarding
         self.has_renaming = has_renaming
         self.log = []
+        self.subscribers = {kind: [] for kind in EventKind}
+        self.start_subscribers = []
+        self.cycle_subscribers = []
+        self.end_subscribers = []
+        if keep_retired:
+            self.subscribe(lambda instr, event: self.retired.append(instr), [EventKind.commit])
+        if keep_log:
+            self.subscribe(lambda instr, event: self.log.append((event, instr)))
+        self.source = None
+        # Stall causes of issue and commit slots, see metrics.attach_cpi_stack
+        self.cpi = None
+        self.roi = None
+        self.n_read = 0
+        self.pending = None
+        # Branch events logged on the head of the queue, which may be retried
+        self.head_branch_events = set()
+        # Without events on instructions, models can share them
+        self.record_events = record_events
+        self.cycle = 0
+        self.stopped = False
+
+    # Arguments of __init__ which do not change the simulated microarchitecture
+    options = ['debug', 'keep_retired', 'keep_log', 'record_events']
+
+    def subscribe(self, callback, kinds=None):
+        """Call callback(instr, event) on events of the given kinds (all if None)"""
+        for kind in kinds or EventKind:
+            self.subscribers[kind].append(callback)
+
+    def subscribe_start(self, callback):
+        """Call callback(model) when a run starts"""
+        self.start_subscribers.append(callback)
+
+    def subscribe_cycles(self, callback):
+        """Call callback(model, cycle) at the end of each cycle"""
+        self.cycle_subscribers.append(callback)
+
+    def subscribe_end(self, callback):
+        """Call callback(model, n_cycles) at the end of the run"""
+        self.end_subscribers.append(callback)
 
     def log_event_on(self, instr, kind, cycle):
         """Log an event on the instruction"""
         if self.debug:
             print(f"{instr}: {kind}")
         event = Event(kind, cycle)
-        instr.events.append(event)
-        self.log.append((event, instr))
-
-    def predict_branch(self, instr):
+        if self.record_events:
+            if instr.events:
+                instr.events.append(event)
+            else:
+                instr.events = [event]
+        for callback in self.subscribers[kind]:
+            callback(instr, event)
+
+    def predict_branch(self, instr, d):
         """Predict if branch is taken or not"""
         pred = self.bht.predict(instr.address)
         if pred is not None:
             return pred
-        return instr.offset() >> 31 != 0
+        return d.backward
 
-    def predict_regjump(self, instr):
+    def predict_regjump(self, instr, d):
         """Predict destination address of indirect jump"""
-        if instr.is_ret():
+        if d.is_ret:
             return self.ras.read() or 0
-        return 0 # always miss, as there is no btb yet
+        if self.btb is not None:
+            return self.btb.predict(instr.address) or 0
+        return 0 # always miss without btb
 
-    def predict_pc(self, last):
+    def predict_pc(self, last, d):
         """Predict next program counter depending on last issued instruction"""
-        if last.is_branch():
-            taken = self.predict_branch(last)
-            offset = to_signed(last.offset()) if taken else last.size()
-            return last.address + offset
-        if last.is_regjump():
-            return self.predict_regjump(last)
+        if d.is_branch:
+            taken = self.predict_branch(last, d)
+            return last.address + (d.taken_offset if taken else d.size)
+        if d.is_regjump:
+            return self.predict_regjump(last, d)
         return None
 
     def issue_manage_last_branch(self, instr, cycle):
         """Flush IQ if branch miss, jump if branch hit"""
         if self.last_issued is not None:
             last = self.last_issued.instr
-            pred = self.predict_pc(last)
+            d = decode(last)
+            pred = self.predict_pc(last, d)
             if pred is not None:
                 bmiss = pred != instr.address
                 resolved = cycle >= self.last_issued.issue_cycle + 6
                 if bmiss and not resolved:
                     self.iqlen.flush()
                 branch = EventKind.BMISS if bmiss else EventKind.BHIT
-                if branch not in [e.kind for e in instr.events]:
+                if branch not in self.head_branch_events:
+                    self.head_branch_events.add(branch)
                     self.log_event_on(instr, branch, cycle)
-                    taken = instr.address != last.next_addr()
+                    taken = instr.address != last.address + d.size
                     if taken and not bmiss:
                         # last (not instr) was like a jump
                         self.iqlen.jump()
@@ -420,142 +556,498 @@ class Model:
         "Resolve branch prediction"
         if self.last_committed is not None:
             last = self.last_committed
-            if last.is_branch():
-                taken = instr.address != last.next_addr()
+            d = decode(last)
+            if d.is_branch:
+                taken = instr.address != last.address + d.size
                 self.bht.resolve(last.address, taken)
+            elif self.btb is not None and d.is_regjump and not d.is_ret:
+                self.btb.resolve(last.address, instr.address)
         self.last_committed = instr
 
-    def find_data_hazards(self, instr, cycle):
-        """Detect and log data hazards"""
-        found = False
+    def find_data_hazards(self, instr, d, cycle):
+        """Detect and log data hazards, returns 'RAW', 'WAW' or None"""
+        found = None
         for entry in self.scoreboard:
-            if instr.has_WAW_from(entry.instr) and not self.has_renaming:
+            writes = decoded[entry.instr.bin].writes
+            if writes is None:
+                continue
+            if writes == d.writes and not self.has_renaming:
                 self.log_event_on(instr, EventKind.WAW, cycle)
-                found = True
+                found = found or 'WAW'
             can_forward = self.has_forwarding and entry.done
-            if instr.has_RAW_from(entry.instr) and not can_forward:
+            if writes in d.reads and not can_forward:
                 self.log_event_on(instr, EventKind.RAW, cycle)
-                found = True
+                found = 'RAW'
         return found
 
-    def find_structural_hazard(self, instr, cycle):
+    def find_structural_hazard(self, instr, d, cycle):
         """Detect and log structural hazards"""
-        if not self.fus.is_ready_for(instr):
+        # A divider which is not pipelined keeps the unit busy until done
+        divider_busy = cycle < self.div_busy_until and d.is_muldiv
+        if divider_busy or not self.fus.is_ready(d.fu):
             self.log_event_on(instr, EventKind.STRUCT, cycle)
             return True
         return False
 
     def try_issue(self, cycle):
-        """Try to issue an instruction"""
-        if len(self.instr_queue) == 0 or len(self.scoreboard) >= self.sb_len:
-            return
-        can_issue = True
+        """Try to issue an instruction, returns the reason if it could not"""
+        if len(self.instr_queue) == 0:
+            return 'empty'
+        if len(self.scoreboard) >= self.sb_len:
+            return 'sb_full'
         instr = self.instr_queue[0]
-        if self.find_data_hazards(instr, cycle):
-            can_issue = False
-        if self.find_structural_hazard(instr, cycle):
-            can_issue = False
+        d = decode(instr)
+        stall = self.find_data_hazards(instr, d, cycle)
+        if self.find_structural_hazard(instr, d, cycle) and stall is None:
+            stall = d.struct_stall
         self.issue_manage_last_branch(instr, cycle)
-        if not self.iqlen.has(instr):
-            can_issue = False
-        if can_issue:
-            self.iqlen.remove(instr)
+        if self.icache_misses and id(instr) in self.icache_misses:
+            self.icache_misses.remove(id(instr))
+            self.iqlen.miss(self.icache.miss_latency)
+        if not self.iqlen.has(instr, d):
+            # Fetch stalls hide the other hazards
+            if self.iqlen.missing:
+                stall = 'ICACHE'
+            else:
+                stall = 'BMISS' if self.iqlen.refilling else 'fetch'
+        if stall is None:
+            self.iqlen.remove(instr, d)
             instr = self.instr_queue.pop(0)
+            self.head_branch_events.clear()
             self.log_event_on(instr, EventKind.issue, cycle)
-            entry = Entry(instr)
+            done_cycle = cycle + self.latencies[d.kind]
+            entry = Entry(instr, done_cycle)
+            self.wheel[done_cycle % len(self.wheel)].append(entry)
+            if d.is_div and not self.pipelined_div:
+                self.div_busy_until = done_cycle
             self.scoreboard.append(entry)
-            self.fus.issue(instr)
+            self.fus.issue(d.fu)
             self.last_issued = LastIssue(instr, cycle)
-            self.ras.resolve(instr)
+            self.ras.resolve(instr, d)
+        return stall
 
     def try_execute(self, cycle):
-        """Try to execute instructions"""
-        for entry in self.scoreboard:
-            entry.cycles_since_issue += 1
-            instr = entry.instr
-            duration = 1
-            if instr.is_load() or instr.is_store():
-                duration = 2
-            if instr.is_muldiv():
-                duration = 2
-            if entry.cycles_since_issue == duration:
-                self.log_event_on(instr, EventKind.done, cycle)
+        """Mark the instructions completing this cycle as done, in issue order"""
+        slot = cycle % len(self.wheel)
+        completing = self.wheel[slot]
+        if completing:
+            self.wheel[slot] = []
+            for entry in completing:
+                self.log_event_on(entry.instr, EventKind.done, cycle)
                 entry.done = True
 
     def try_commit(self, cycle, commit_port):
-        """Try to commit an instruction"""
+        """Try to commit an instruction, returns the reason if it could not"""
         if len(self.scoreboard) == 0:
-            return
+            return 'sb_empty'
         entry = self.scoreboard[0]
-        can_commit = True
+        stall = None
         if commit_port > 0:
-            if entry.instr.is_store():
-                can_commit = False
+            if decoded[entry.instr.bin].is_store:
+                stall = 'store_port'
         if not entry.done:
-            can_commit = False
-        if can_commit:
+            stall = 'executing'
+        if stall is None:
             instr = self.scoreboard.pop(0).instr
             self.log_event_on(instr, EventKind.commit, cycle)
-            self.retired.append(instr)
             self.commit_manage_last_branch(instr, cycle)
+        return stall
 
     def run_cycle(self, cycle):
         """Runs a cycle"""
         self.fus.cycle()
         for commit_port in range(self.commit_width):
-            self.try_commit(cycle, commit_port)
+            stall = self.try_commit(cycle, commit_port)
+            if self.cpi is not None:
+                self.cpi.commit_slot(stall)
         self.try_execute(cycle)
         for _ in range(self.issue_width):
-            self.try_issue(cycle)
+            stall = self.try_issue(cycle)
+            if self.cpi is not None:
+                self.cpi.issue_slot(stall)
         self.iqlen.fetch()
 
-    def load_file(self, path):
-        """Fill a model from a trace file"""
-        with open(path, "r", encoding="utf8") as file:
-            for line in [l.strip() for l in file]:
-                found = Model.re_instr.search(line)
-                if found:
-                    address = found.group(2)
-                    hex_code = found.group(3)
-                    mnemo = found.group(5)
-                    instr = Instruction(line, address, hex_code, mnemo)
-                    self.instr_queue.append(instr)
+    def load_file(self, path, workers=None):
+        """Fill a model from a trace file, parsed by worker processes if workers > 1"""
+        if workers and workers > 1:
+            self.instr_queue.extend(read_instructions_parallel(path, workers))
+        else:
+            self.instr_queue.extend(read_instructions(path))
+
+    stream_lookahead = 64
+
+    def load_range(self, path, start=0, end=None, cycles=None):
+        """Fill the model with the instructions [start, end) of a trace file, or
+        those of the simulator cycles [start, end) if cycles, seeking with its index
+
+        Returns the [begin, end) ranges of the loaded instructions which are in
+        the timed part, known from the markers of the index."""
+        index = index_trace(path)
+        if cycles:
+            start = index.instruction_at_cycle(start)
+            end = None if end is None else index.instruction_at_cycle(end)
+        self.load_stream(read_instruction_range(path, start, end, index))
+        return index.timed_within(start, end)
+
+    def load_stream(self, instructions):
+        """Fill the model from an iterable of instructions while it runs
+
+        Lines of a stream are only kept from the last committed instruction."""
+        self.source = iter(instructions)
+        self.subscribe(self.release_line, [EventKind.commit])
+
+    def release_line(self, instr, event=None):
+        """Forget the trace text before an instruction, which stays readable"""
+        instr.text.release(instr.line_offset)
+
+    def fast_forward(self, roi):
+        """Only simulate the region of interest in detail, warm predictors elsewhere"""
+        self.roi = roi
+
+    def refill(self):
+        """Top up the instruction queue from the stream"""
+        while len(self.instr_queue) < self.stream_lookahead:
+            if self.pending is not None:
+                if self.instr_queue or self.scoreboard:
+                    # Wait for the region of interest to drain
+                    break
+                self.warm(self.pending)
+                self.pending = None
+            instr = next(self.source, None)
+            if instr is None:
+                self.source = None
+                break
+            self.n_read += 1
+            if not self.icache_ahead:
+                self.lookup_icache(instr)
+            if self.roi is not None and not self.roi.selects(instr, self.n_read - 1):
+                self.pending = instr
+                continue
+            self.instr_queue.append(instr)
+
+    def lookup_icache(self, instr):
+        """Fetch an instruction from the instruction cache, if any"""
+        if self.icache is not None and self.icache.fetch(instr.address):
+            self.icache_misses.add(id(instr))
+
+    def feed(self, instructions):
+        """Append instructions to the queue of a running model, see Lockstep"""
+        for instr in instructions:
+            self.n_read += 1
+            self.lookup_icache(instr)
+            self.instr_queue.append(instr)
+
+    def warm(self, instr):
+        """Functionally update predictors with an instruction outside of the region"""
+        self.release_line(instr)
+        self.ras.resolve(instr, decode(instr))
+        self.commit_manage_last_branch(instr, None)
+        self.icache_misses.discard(id(instr))
+        # Detailed simulation restarts as after a redirection
+        self.last_issued = None
+        self.iqlen = IqLen(self.iqlen.fetch_size, self.debug)
+
+    def state_signature(self, cycle):
+        """Hashable microarchitectural state at the end of a cycle
+
+        Instructions are identified by address and code, and cycles are
+        relative, so that the state of two iterations of a loop can be equal."""
+        last = self.last_issued
+        iqlen = self.iqlen
+        return (
+            tuple((e.instr.address, e.instr.bin, max(e.done_cycle - cycle, 0), e.done)
+                  for e in self.scoreboard),
+            max(self.div_busy_until - cycle, 0),
+            tuple(vars(self.fus).values()),
+            (iqlen.len, iqlen.new_fetch, iqlen.refilling, iqlen.missing, iqlen.stall_cycles),
+            # Only matters until the branch resolves (issue_manage_last_branch)
+            last and (last.instr.address, last.instr.bin, min(cycle - last.issue_cycle, 6)),
+            self.last_committed and (self.last_committed.address, self.last_committed.bin),
+            frozenset(self.head_branch_events),
+            self.bht.state(),
+            self.ras.state(),
+            self.btb and self.btb.state(),
+        )
+
+    def skip(self, n_instr, n_cycles):
+        """Jump over instructions whose simulation leaves the state unchanged"""
+        del self.instr_queue[:n_instr]
+        self.cycle += n_cycles
+        if self.last_issued is not None:
+            self.last_issued.issue_cycle += n_cycles
+        for entry in self.scoreboard:
+            entry.done_cycle += n_cycles
+        self.div_busy_until += n_cycles
+        shift = n_cycles % len(self.wheel)
+        if shift:
+            self.wheel = self.wheel[-shift:] + self.wheel[:-shift]
+
+    def start(self):
+        """Prepare a run, which is then simulated by step"""
+        self.cycle = 0
+        self.stopped = False
+        for callback in self.start_subscribers:
+            callback(self)
+        if self.icache is not None and self.source is None:
+            # Hits and misses of the whole trace, before the detailed simulation
+            self.icache_misses = {id(i) for i in self.icache.miss_pass(self.instr_queue)}
+            self.icache_ahead = True
+        if self.roi is not None and self.source is None:
+            self.load_stream(self.instr_queue)
+            self.instr_queue = []
+        if self.source is not None:
+            self.refill()
+
+    def running(self):
+        """Are there instructions left to simulate?"""
+        return not self.stopped and (len(self.instr_queue) > 0 or len(self.scoreboard) > 0)
+
+    def step(self):
+        """Simulate one cycle"""
+        cycle = self.cycle
+        self.run_cycle(cycle)
+        for callback in self.cycle_subscribers:
+            callback(self, cycle)
+        if self.debug:
+            print(f"Scoreboard @{cycle}")
+            for entry in self.scoreboard:
+                print(f"    {entry}")
+            print(f"iqlen = {self.iqlen.len}")
+            print()
+        self.cycle += 1
+        if self.source is not None:
+            self.refill()
+
+    def finish(self):
+        """End a run, returns the number of cycles"""
+        for callback in self.end_subscribers:
+            callback(self, self.cycle)
+        return self.cycle
 
     def run(self, cycles=None):
         """Run until completion"""
-        cycle = 0
-        while len(self.instr_queue) > 0 or len(self.scoreboard) > 0:
-            self.run_cycle(cycle)
-            if self.debug:
-                print(f"Scoreboard @{cycle}")
-                for entry in self.scoreboard:
-                    print(f"    {entry}")
-                print(f"iqlen = {self.iqlen.len}")
-                print()
-            cycle += 1
-
-            if cycles is not None and cycle > cycles:
+        self.start()
+        while self.running():
+            self.step()
+            if cycles is not None and self.cycle > cycles:
+                break
+        return self.finish()
+
+# Value of hart to merge the instructions of all the harts of a trace
+ALL_HARTS = "all"
+
+def parse_trace(raw_lines, text, hart=None, offset=0):
+    """Iterate over the instructions in lines of a trace
+
+    raw_lines: the lines as bytes, with their line endings
+    text: where the lines can be read back from their position
+    hart: only keep the instructions of this hart id (of the first hart
+    found if None, of all harts if ALL_HARTS)
+    offset: position of the first line in text"""
+    # Address, code and mnemonic are shared by all dynamic instances of a
+    # static instruction
+    statics = {}
+    for raw in raw_lines:
+        stripped = raw.strip()
+        start = offset + len(raw) - len(raw.lstrip())
+        offset += len(raw)
+        found = Model.re_instr.search(stripped.decode("utf8"))
+        if found:
+            if hart is None:
+                hart = int(found.group(2))
+            if hart != ALL_HARTS and int(found.group(2)) != hart:
+                continue
+            key = found.group(3, 4, 6)
+            static = statics.get(key)
+            if static is None:
+                static = statics[key] = (int(key[0], base=16), int(key[1], base=16), key[2])
+            address, bincode, mnemo = static
+            yield Instruction(text, start, len(stripped), address, bincode, mnemo)
+
+def read_instructions(path, hart=None):
+    """Iterate over the instructions of a trace file, of the first hart by
+    default, see parse_trace"""
+    if os.path.getsize(path) == 0:
+        return
+    text = TraceText(path)
+    with open(path, "rb") as file:
+        yield from parse_trace(file, text, hart)
+
+def index_trace(path, interval=1024):
+    """Seekable index of a trace file, see trace_index"""
+    return open_index(path, Model.re_instr, Groups(2, 3, 4, 5, 6), re_csrr_minstret, interval)
+
+def read_instruction_range(path, start=0, end=None, index=None):
+    """Iterate over the instructions [start, end) of a trace file, seeking with its index"""
+    index = index or index_trace(path)
+    end = index.n_instr if end is None else min(end, index.n_instr)
+    if start >= end:
+        return
+    offset, n = index.seek(start)
+    text = TraceText(path)
+    with open(path, "rb") as file:
+        file.seek(offset)
+        for instr in parse_trace(file, text, index.hart, offset):
+            if n >= end:
                 break
-        return cycle
+            if n >= start:
+                yield instr
+            n += 1
+
+def parse_arrays(path, workers=None):
+    """Instructions of a trace file as arrays, see parallel_parse"""
+    return parse_parallel(path, Model.re_instr.pattern, Groups(2, 3, 4, 5, 6),
+                          re_csrr_minstret.pattern, workers)
+
+def read_instructions_parallel(path, workers=None):
+    """Iterate over the instructions of the first hart of a trace file, parsed
+    by several processes"""
+    if os.path.getsize(path) == 0:
+        return
+    parsed = parse_arrays(path, workers)
+    yield from instructions_from_arrays(path, next(iter(parsed.split_harts().values()), parsed))
+
+def instructions_from_arrays(path, parsed):
+    """Iterate over the instructions of a file parsed into arrays"""
+    text = TraceText(path)
+    mnemos = parsed.mnemos
+    # Shared by the dynamic instances of a static instruction, as in parse_trace
+    statics = {}
+    for offset, length, *key in zip(
+            parsed.offsets, parsed.lengths, parsed.addresses, parsed.codes, parsed.mnemo_ids):
+        address, bincode, mnemo_id = statics.setdefault(tuple(key), key)
+        yield Instruction(text, offset, length, address, bincode, mnemos[mnemo_id])
+
+def stream_instructions(raw_lines):
+    """Iterate over the instructions of a trace being read from a stream"""
+    text = StreamText()
+    yield from parse_trace(text.keep(raw_lines), text)
+
+def follow_lines(path, idle_timeout=5.0, poll_interval=0.05):
+    """Lines of a file being written, until it stops growing for idle_timeout seconds
+
+    The file may not exist yet when the simulation is starting: it is waited
+    for up to idle_timeout seconds too."""
+    created_before = time.monotonic() + idle_timeout
+    while not os.path.exists(path):
+        if time.monotonic() > created_before:
+            raise FileNotFoundError(f"{path} was not created within {idle_timeout} s")
+        time.sleep(poll_interval)
+    with open(path, "rb") as file:
+        pending = b""
+        idle_since = time.monotonic()
+        while True:
+            raw = file.readline()
+            if raw:
+                pending += raw
+                idle_since = time.monotonic()
+                if pending.endswith(b"\n"):
+                    yield pending
+                    pending = b""
+            elif time.monotonic() - idle_since > idle_timeout:
+                break
+            else:
+                time.sleep(poll_interval)
+        if pending:
+            yield pending
+
+def pipe_lines(path):
+    """Lines of a named pipe, closed once read or when the reader stops"""
+    with open(path, "rb") as file:
+        yield from file
+
+def open_trace(path, follow=False, workers=None):
+    """Instructions of a trace file, stdin ('-'), a named pipe or a growing file
+
+    Regular files are parsed by worker processes if workers > 1."""
+    if path == "-":
+        return stream_instructions(sys.stdin.buffer)
+    if follow:
+        return stream_instructions(follow_lines(path))
+    if stat.S_ISFIFO(os.stat(path).st_mode):
+        return stream_instructions(pipe_lines(path))
+    if workers and workers > 1:
+        return read_instructions_parallel(path, workers)
+    return read_instructions(path)
+
+class TraceReader:
+    """Parses instructions in a background thread, through a bounded queue"""
+    def __init__(self, instructions, batch_size=1024, max_batches=64):
+        self.queue = queue.Queue(max_batches)
+        self.batch_size = batch_size
+        self.error = None
+        self.thread = threading.Thread(target=self._read, args=(instructions,), daemon=True)
+        self.thread.start()
+
+    def _read(self, instructions):
+        batch = []
+        try:
+            for instr in instructions:
+                batch.append(instr)
+                if len(batch) == self.batch_size:
+                    self.queue.put(batch)
+                    batch = []
+        except Exception as error: # pylint: disable=broad-except
+            self.error = error
+        if batch:
+            self.queue.put(batch)
+        self.queue.put(None)
+
+    def __iter__(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            yield from batch
+        if self.error is not None:
+            raise self.error
+
+def annotate(line, cycle):
+    """Replace the cycle number of a trace line"""
+    at = line.find("@")
+    if at < 0:
+        return line
+    end = at + 1
+    while end < len(line) and line[end].isspace():
+        end += 1
+    start = end
+    while end < len(line) and "0" <= line[end] <= "9":
+        end += 1
+    if end == start:
+        return line
+    return f"{line[:at]}@ {cycle}{line[end:]}"
+
+class AnnotatedTraceWriter:
+    """Writes the cycle-annotated trace while instructions commit"""
+    def __init__(self, output_file, buffer_size=1 << 20):
+        self.file = open(output_file, "w", encoding="utf8", buffering=buffer_size)
+
+    def write(self, instr, cycle):
+        """Write the line of a committed instruction"""
+        self.file.write(annotate(instr.line, cycle))
+        self.file.write("\n")
+
+    def commit(self, instr, event):
+        """Commit event subscriber"""
+        self.write(instr, event.cycle)
+
+    def close(self):
+        """Flush and close the output file"""
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 def write_trace(output_file, instructions):
     """Write cycle-annotated trace"""
-    pattern = re.compile(r"@\s*[0-9]+")
-
-    lines = []
-    for instr in instructions:
-        commit_event = instr.events[-1]
-        assert commit_event.kind == EventKind.commit
-        cycle = commit_event.cycle
-        annotated = re.sub(pattern, f"@ {cycle}", instr.line)
-        #if EventKind.STRUCT in [e.kind for e in instr.events]:
-        #    annotated += " #STRUCT"
-        #if EventKind.RAW in [e.kind for e in instr.events]:
-        #    annotated += " #RAW"
-        lines.append(f"{annotated}\n")
-
-    with open(output_file, 'w') as f:
-        f.writelines(lines)
+    with AnnotatedTraceWriter(output_file) as writer:
+        for instr in instructions:
+            commit_event = instr.events[-1]
+            assert commit_event.kind == EventKind.commit
+            writer.write(instr, commit_event.cycle)
 
 def print_data(name, value, ts=24, sep='='):
     "Prints 'name = data' with alignment of the '='"
@@ -600,11 +1092,8 @@ def issue_commit_graph(input_file, n = 3):
         for issue in r:
             for commit in r:
                 print("running", issue, commit)
-                model = Model(issue=issue, commit=commit)
-                model.load_file(input_file)
-                model.run()
-                n_cycles = count_cycles(filter_timed_part(model.retired))
-                score = 1000000 / n_cycles
+                stats = run_cached(input_file, issue=issue, commit=commit)
+                score = stats["coremark_mhz"]
                 scores[issue][commit] = score
         print(scores)
     display_scores(scores)
@@ -612,7 +1101,6 @@ def issue_commit_graph(input_file, n = 3):
 def filter_timed_part(all_instructions):
     "Keep only timed part from a trace"
     filtered = []
-    re_csrr_minstret = re.compile(r"^csrr\s+\w\w,\s*minstret$")
     accepting = False
     for instr in all_instructions:
         if re_csrr_minstret.search(instr.mnemo):
@@ -627,31 +1115,208 @@ def count_cycles(retired):
     end = max(e.cycle for e in retired[-1].events)
     return end - start
 
-def print_stats(instructions):
+def summarize(instructions):
+    "Statistics of a list of retired instructions"
     ecount = defaultdict(lambda: 0)
 
     for instr in instructions:
         for e in instr.events:
-            ecount[e.kind] += 1
-            cycle = e.cycle
-    n_instr = len(instructions)
+            ecount[e.kind.name] += 1
     n_cycles = count_cycles(instructions)
 
-    print_data("cycle number", n_cycles)
-    print_data("Coremark/MHz", 1000000 / n_cycles)
-    print_data("instruction number", n_instr)
-    for ek, count in ecount.items():
-        print_data(f"{ek}/instr", f"{100 * count / n_instr:.2f}%")
+    return {
+        "cycles": n_cycles,
+        "coremark_mhz": 1000000 / n_cycles,
+        "instructions": len(instructions),
+        "events": dict(ecount),
+    }
+
+class TimedStats:
+    "Statistics of the timed part, computed while instructions commit"
+    def __init__(self):
+        self.ecount = defaultdict(lambda: 0)
+        self.n_instr = 0
+        self.accepting = False
+        self.start = None
+        self.end = None
+        # Events of the instructions not committed yet, by id
+        self.in_flight = {}
+
+    def event(self, instr, event):
+        "Event subscriber, for events of all kinds"
+        events = self.in_flight.setdefault(id(instr), [])
+        events.append(event)
+        if event.kind == EventKind.commit:
+            del self.in_flight[id(instr)]
+            self.commit(instr, events)
+
+    def commit(self, instr, events):
+        "Account a committed instruction and its events"
+        if re_csrr_minstret.search(instr.mnemo):
+            self.accepting = not self.accepting
+            return
+        if not self.accepting:
+            return
+        for e in events:
+            self.ecount[e.kind.name] += 1
+        if self.start is None:
+            self.start = min(e.cycle for e in events)
+        self.end = max(e.cycle for e in events)
+        self.n_instr += 1
+
+    def summary(self):
+        """Same statistics as summarize, with no cycles and no score if
+        there is no timed part"""
+        n_cycles = self.end - self.start if self.n_instr else 0
+        return {
+            "cycles": n_cycles,
+            "coremark_mhz": 1000000 / n_cycles if n_cycles else None,
+            "instructions": self.n_instr,
+            "events": dict(self.ecount),
+        }
 
-def main(input_file: str):
-    "Entry point"
+def print_stats(instructions):
+    print_summary(summarize(instructions))
 
-    model = Model(debug=True, issue=2, commit=2)
-    model.load_file(input_file)
-    model.run()
+def print_summary(stats):
+    "Print statistics returned by summarize"
+    n_instr = stats["instructions"]
 
-    write_trace('annotated.log', model.retired)
-    print_stats(filter_timed_part(model.retired))
+    print_data("cycle number", stats["cycles"])
+    print_data("Coremark/MHz", stats["coremark_mhz"])
+    print_data("instruction number", n_instr)
+    for name, count in stats["events"].items():
+        print_data(f"{EventKind[name]}/instr", f"{100 * count / n_instr:.2f}%")
+    if "memory" in stats:
+        print_data("peak bytes/Minstr", stats["memory"]["peak_bytes_per_minstr"])
+
+def model_parameters(**params):
+    "Complete parameters with the default values of Model"
+    bound = inspect.signature(Model).bind(**params)
+    bound.apply_defaults()
+    return {k: v for k, v in bound.arguments.items() if k not in Model.options}
+
+def run_stats(instructions, annotated=None, attach=None, **params):
+    """Statistics of the timed part of a run on instructions
+
+    attach: if not None, called with the model before the run, e.g. to
+    subscribe an analysis (see memstats.run_stats)"""
+    model = Model(keep_retired=False, keep_log=False, **params)
+    model.load_stream(instructions)
+    stats = TimedStats()
+    model.subscribe(stats.event)
+    if attach is not None:
+        attach(model)
+    if annotated is not None:
+        with AnnotatedTraceWriter(annotated) as writer:
+            model.subscribe(writer.commit, [EventKind.commit])
+            model.run()
+    else:
+        model.run()
+    return stats.summary()
+
+def _run_hart(path, parsed, params):
+    return run_stats(instructions_from_arrays(path, parsed), **params)
+
+def run_harts(path, workers=None, **params):
+    """Statistics of the timed part of each hart of a multi-core trace
+
+    The trace is demultiplexed in a single pass, then an independent model
+    runs on each hart in its own process."""
+    harts = parse_arrays(path, workers).split_harts()
+    with ProcessPoolExecutor(min(workers or os.cpu_count(), len(harts) or 1)) as pool:
+        futures = {hart: pool.submit(_run_hart, path, parsed, params)
+                   for hart, parsed in harts.items()}
+        return {hart: future.result() for hart, future in futures.items()}
+
+def aggregate_stats(hart_stats):
+    """Statistics of harts running together: the cycles of the slowest one,
+    the sum of instructions, events and CoreMark scores
+
+    Harts without a timed part are left out."""
+    hart_stats = {hart: stats for hart, stats in hart_stats.items() if stats["instructions"]}
+    events = defaultdict(int)
+    for stats in hart_stats.values():
+        for name, count in stats["events"].items():
+            events[name] += count
+    return {
+        "cycles": max(stats["cycles"] for stats in hart_stats.values()),
+        "coremark_mhz": sum(stats["coremark_mhz"] for stats in hart_stats.values()),
+        "instructions": sum(stats["instructions"] for stats in hart_stats.values()),
+        "events": dict(events),
+    }
+
+def print_harts(hart_stats):
+    "Print the statistics of each hart then of all of them"
+    for hart, stats in hart_stats.items():
+        print(f"hart {hart}")
+        if stats["instructions"]:
+            print_summary(stats)
+        else:
+            print("no timed part")
+    if sum(1 for stats in hart_stats.values() if stats["instructions"]) > 1:
+        print("all harts")
+        print_summary(aggregate_stats(hart_stats))
+
+class Lockstep:
+    """Several configurations simulated in a single pass over a trace
+
+    Instructions are read and parsed once, and fed by batches to all the
+    models, which do not record events on them. Static instructions are
+    decoded once, in the table shared by all the models. Cycles and statistics are
+    identical to separate runs. Regions of interest are not supported."""
+
+    def __init__(self, configs, batch_size=1024):
+        self.models = [Model(keep_retired=False, keep_log=False, record_events=False, **config)
+                       for config in configs]
+        self.stats = [TimedStats() for _ in self.models]
+        for model, stats in zip(self.models, self.stats):
+            model.subscribe(stats.event)
+        self.batch_size = batch_size
+
+    def run(self, instructions):
+        """Cycles of each model"""
+        source = iter(instructions)
+        for model in self.models:
+            model.start()
+        while True:
+            batch = list(itertools.islice(source, self.batch_size))
+            for model in self.models:
+                model.feed(batch)
+                if batch:
+                    # Instructions stay queued, as when the whole trace is loaded
+                    while len(model.instr_queue) > model.stream_lookahead:
+                        model.step()
+                else:
+                    while model.running():
+                        model.step()
+            if not batch:
+                return [model.finish() for model in self.models]
+
+    def summaries(self):
+        """Statistics of the timed part of each run, as run_stats"""
+        return [stats.summary() for stats in self.stats]
+
+def run_cached(input_file, annotated=None, cache=None, **params):
+    "Statistics of the timed part of a run, reusing the results of identical runs"
+    cache = cache or ResultCache()
+    params = model_parameters(**params)
+    key = cache.key(input_file, params)
+    stats = cache.get(key, annotated)
+    if stats is None:
+        stats = run_stats(read_instructions(input_file), annotated, **params)
+        cache.put(key, input_file, params, stats, annotated)
+    return stats
+
+def parse_range(spec):
+    """(start, end, cycles) from 'instr:START-END' or 'cycle:START-END'"""
+    kind, _, bounds = spec.partition(":")
+    start, _, end = bounds.partition("-")
+    if kind not in ["instr", "cycle"] or not start:
+        raise ValueError(f"bad range '{spec}'")
+    return int(start, 0), int(end, 0) if end else None, kind == "cycle"
 
 if __name__ == "__main__":
-    main(sys.argv[1])
+    # The command line attaches analyses which import this module
+    from model_cli import main
+    main(sys.argv[1:])
@@ -0,0 +1,95 @@
+"""
+Command line of the CVA6 performance model, `python3 model.py <trace>`
+
+The model runs with debug output and writes `annotated.log`. Analyses
+(metrics, CPI stacks, memory accounting, pipeline view) are attached to the
+model from their own modules, which model.py does not import.
+"""
+
+import sys
+import argparse
+
+import kanata
+import metrics
+import memstats
+
+from model import (Model, EventKind, AnnotatedTraceWriter, TraceReader, open_trace,
+                   parse_range, filter_timed_part, print_stats, print_harts, run_harts)
+from roi import parse_roi
+
+def run(input_file: str, follow=False, metrics_path=None, window=1000, cpi_stack=False, roi=None,
+        jobs=None, harts=False, kanata_path=None, trace_range=None, memory=None):
+    "Run the model on a trace and print its statistics"
+
+    if harts:
+        print_harts(run_harts(input_file, jobs, issue=2, commit=2))
+        return
+
+    model = Model(debug=True, issue=2, commit=2)
+    timed = None
+    if trace_range is not None:
+        timed = model.load_range(input_file, *parse_range(trace_range))
+    else:
+        model.load_stream(TraceReader(open_trace(input_file, follow, jobs)))
+    if roi is not None:
+        model.fast_forward(parse_roi(roi))
+    if metrics_path is not None:
+        recorder = metrics.attach(model, window)
+    if cpi_stack:
+        stack = metrics.attach_cpi_stack(model)
+    if memory is not None:
+        memory_stats = memstats.attach(model, memory)
+    if kanata_path is not None:
+        kanata.attach(model, kanata_path)
+    with AnnotatedTraceWriter('annotated.log') as writer:
+        model.subscribe(writer.commit, [EventKind.commit])
+        model.run()
+
+    if timed is None:
+        instructions = filter_timed_part(model.retired)
+    else:
+        # The markers may be outside of the range
+        instructions = [instr for begin, end in timed for instr in model.retired[begin:end]]
+    if instructions:
+        print_stats(instructions)
+    else:
+        print("no timed part in the simulated instructions")
+    if metrics_path is not None:
+        recorder.write(metrics_path)
+    if cpi_stack:
+        stack.report(len(model.retired))
+    if memory is not None:
+        memory_stats.report()
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description="CVA6 performance model")
+    parser.add_argument("trace", help="RVFI trace: file, named pipe or '-' for stdin")
+    parser.add_argument("--follow", action="store_true",
+                        help="read a trace while the simulator writes it")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write windowed metrics (.csv or .npz)")
+    parser.add_argument("--window", type=int, default=1000,
+                        help="cycles per metrics window")
+    parser.add_argument("--cpi-stack", action="store_true",
+                        help="print the stall causes of issue and commit slots")
+    parser.add_argument("--roi", metavar="REGION",
+                        help="only simulate 'minstret', 'addr:START-END' or 'count:START-END' "
+                        "in detail, fast-forward the rest")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="parse a trace file with this many processes")
+    parser.add_argument("--harts", action="store_true",
+                        help="run one model per hart of a multi-core trace, in parallel")
+    parser.add_argument("--kanata", metavar="PATH",
+                        help="write the pipeline view for the Konata viewer")
+    parser.add_argument("--range", metavar="RANGE",
+                        help="only read 'instr:START-END' instructions or 'cycle:START-END' "
+                        "simulator cycles, seeking with an index of the trace")
+    parser.add_argument("--memory", type=int, metavar="CYCLES",
+                        help="sample the memory held by the model every CYCLES cycles")
+    args = parser.parse_args(argv)
+    run(args.trace, args.follow, args.metrics, args.window, args.cpi_stack, args.roi, args.jobs,
+        args.harts, args.kanata, args.range, args.memory)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
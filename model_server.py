@@ -0,0 +1,172 @@
+"""
+Resident model server keeping parsed traces in memory
+
+Each trace is parsed and kept by a single worker process, which runs all
+the queries on it. Least recently used traces are dropped when the
+instructions held by all the workers exceed the budget. Queries are
+JSON requests over localhost HTTP:
+
+    POST /run    {"trace": "<path>", "params": {"issue": 2, "commit": 2}}
+    GET  /status
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request
+
+from model import read_instructions, run_stats
+
+DEFAULT_PORT = 8642
+
+class TraceStore:
+    """Traces held by the workers, least recently used first
+
+    All the queries on a trace go to the same worker, which parses it once
+    and keeps it until the instructions held by all the workers exceed the
+    budget."""
+    def __init__(self, workers, budget):
+        self.pools = [ProcessPoolExecutor(1) for _ in range(workers)]
+        self.budget = budget
+        # Number of instructions by trace key
+        self.traces = OrderedDict()
+        self.lock = threading.Lock()
+
+    def worker(self, key):
+        """The worker holding a trace"""
+        return self.pools[hash(key) % len(self.pools)]
+
+    def run(self, path, params):
+        """Statistics of a run on a trace, parsed again if the file changed"""
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        n_instr, stats = self.worker(key).submit(_run, key, path, params).result()
+        with self.lock:
+            self.traces[key] = n_instr
+            self.traces.move_to_end(key)
+            self._evict()
+        return stats
+
+    def size(self):
+        """Number of instructions held"""
+        return sum(self.traces.values())
+
+    def _evict(self):
+        while len(self.traces) > 1 and self.size() > self.budget:
+            key, _ = self.traces.popitem(last=False)
+            self.worker(key).submit(_drop, key)
+
+    def shutdown(self):
+        """Stop the workers"""
+        for pool in self.pools:
+            pool.shutdown(cancel_futures=True)
+
+# Traces parsed by a worker process, by key
+_traces = {}
+
+def _run(key, path, params):
+    if key not in _traces:
+        _traces[key] = list(read_instructions(path))
+    instructions = _traces[key]
+    # TimedStats collects the events, cached instructions do not keep them
+    return len(instructions), run_stats(instructions, **{**params, "record_events": False})
+
+def _drop(key):
+    _traces.pop(key, None)
+
+class Handler(BaseHTTPRequestHandler):
+    """JSON requests to the model"""
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+        self._reply(200, {
+            "workers": self.server.workers,
+            "budget": self.server.store.budget,
+            "traces": len(self.server.store.traces),
+            "instructions": self.server.store.size(),
+            "served": self.server.served,
+        })
+
+    def do_POST(self):
+        if self.path != "/run":
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            query = json.loads(self.rfile.read(length))
+            trace = query["trace"]
+            params = query.get("params", {})
+        except (ValueError, KeyError, TypeError) as error:
+            self._reply(400, {"error": f"bad request: {error}"})
+            return
+        try:
+            stats = self.server.store.run(trace, params)
+        except (OSError, TypeError, ValueError) as error:
+            self._reply(400, {"error": str(error)})
+            return
+        except Exception as error: # pylint: disable=broad-except
+            self._reply(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        self.server.served += 1
+        self._reply(200, {"stats": stats})
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, code, content):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(port=DEFAULT_PORT, workers=None, budget=50_000_000, verbose=False):
+    """Answer queries until interrupted"""
+    workers = workers or os.cpu_count()
+    store = TraceStore(workers, budget)
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.store = store
+    server.workers = workers
+    server.served = 0
+    server.verbose = verbose
+    print(f"serving on http://127.0.0.1:{port} with {workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        store.shutdown()
+
+def query(trace, port=DEFAULT_PORT, **params):
+    """Statistics of a run, computed by a running server"""
+    body = json.dumps({"trace": os.path.abspath(trace), "params": params}).encode()
+    req = request.Request(f"http://127.0.0.1:{port}/run", data=body,
+                          headers={"Content-Type": "application/json"})
+    with request.urlopen(req) as reply:
+        return json.loads(reply.read())["stats"]
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description="Resident CVA6 model server")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: number of CPUs)")
+    parser.add_argument("--budget", type=int, default=50_000_000,
+                        help="instructions kept in memory by all the workers")
+    parser.add_argument("--verbose", action="store_true", help="log requests")
+    args = parser.parse_args(argv)
+    serve(args.port, args.workers, args.budget, args.verbose)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
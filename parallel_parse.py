@@ -0,0 +1,173 @@
+"""
+Parses huge RVFI traces with several processes
+
+The file is split into byte ranges starting at line boundaries. Each range
+is parsed by a worker process into typed arrays, which are concatenated in
+file order. `csrr minstret` markers are located by each worker and numbered
+globally afterwards, so the timed part is found even when it spans chunks.
+
+Traces of multi-core systems are demultiplexed by hart id afterwards.
+"""
+
+import os
+import re
+
+from array import array
+from multiprocessing import Pool
+
+class Groups:
+    """Indices of the groups of a trace regular expression (0 if absent)"""
+    def __init__(self, hart, address, code, cycle, mnemo, flags=0):
+        self.hart = hart
+        self.address = address
+        self.code = code
+        self.cycle = cycle
+        self.mnemo = mnemo
+        self.flags = flags
+
+def split_ranges(path, n_chunks):
+    """Byte ranges of a file, each starting at the beginning of a line"""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as file:
+        for k in range(1, n_chunks):
+            file.seek(max(k * size // n_chunks, bounds[-1]))
+            file.readline()
+            position = min(file.tell(), size)
+            if position > bounds[-1]:
+                bounds.append(position)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+class Chunk:
+    """Instructions of a byte range, as arrays"""
+    def __init__(self):
+        self.harts = array('H')
+        self.offsets = array('Q')
+        self.lengths = array('L')
+        self.addresses = array('Q')
+        self.address_widths = array('B')
+        self.codes = array('L')
+        self.cycles = array('Q')
+        self.mnemo_ids = array('L')
+        self.mnemos = []
+        self.flag_ids = array('L')
+        self.flags = []
+        self.markers = array('Q')
+
+def _intern(table, index, value):
+    found = index.get(value)
+    if found is None:
+        found = index[value] = len(table)
+        table.append(value)
+    return found
+
+def _parse_range(path, pattern, groups, marker_pattern, start, end):
+    regex = re.compile(pattern)
+    marker = re.compile(marker_pattern)
+    chunk = Chunk()
+    mnemo_index = {}
+    flag_index = {}
+    with open(path, "rb") as file:
+        file.seek(start)
+        offset = start
+        # Line by line, not to hold the text of the whole range
+        while offset < end:
+            raw = file.readline()
+            if not raw:
+                break
+            stripped = raw.strip()
+            line_start = offset + len(raw) - len(raw.lstrip())
+            offset += len(raw)
+            found = regex.search(stripped.decode("utf8"))
+            if not found:
+                continue
+            mnemo = found.group(groups.mnemo)
+            if marker.search(mnemo):
+                chunk.markers.append(len(chunk.addresses))
+            address = found.group(groups.address)
+            chunk.harts.append(int(found.group(groups.hart)))
+            chunk.offsets.append(line_start)
+            chunk.lengths.append(len(stripped))
+            chunk.addresses.append(int(address, base=16))
+            chunk.address_widths.append(len(address))
+            chunk.codes.append(int(found.group(groups.code), base=16))
+            chunk.cycles.append(int(found.group(groups.cycle)) if groups.cycle else 0)
+            chunk.mnemo_ids.append(_intern(chunk.mnemos, mnemo_index, mnemo))
+            flags = found.group(groups.flags) if groups.flags else ""
+            chunk.flag_ids.append(_intern(chunk.flags, flag_index, flags))
+    return chunk
+
+def _parse_args(args):
+    return _parse_range(*args)
+
+class ParsedTrace(Chunk):
+    """Instructions of a whole trace, as arrays"""
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def append(self, chunk):
+        """Concatenate the instructions of the next chunk"""
+        first = len(self)
+        mnemo_index = {m: i for i, m in enumerate(self.mnemos)}
+        flag_index = {f: i for i, f in enumerate(self.flags)}
+        mnemo_ids = [_intern(self.mnemos, mnemo_index, m) for m in chunk.mnemos]
+        flag_ids = [_intern(self.flags, flag_index, f) for f in chunk.flags]
+        self.harts.extend(chunk.harts)
+        self.offsets.extend(chunk.offsets)
+        self.lengths.extend(chunk.lengths)
+        self.addresses.extend(chunk.addresses)
+        self.address_widths.extend(chunk.address_widths)
+        self.codes.extend(chunk.codes)
+        self.cycles.extend(chunk.cycles)
+        self.mnemo_ids.extend(mnemo_ids[i] for i in chunk.mnemo_ids)
+        self.flag_ids.extend(flag_ids[i] for i in chunk.flag_ids)
+        self.markers.extend(first + i for i in chunk.markers)
+
+    def timed(self):
+        """Indices of the instructions between pairs of markers, markers excluded"""
+        markers = list(self.markers)
+        if len(markers) % 2:
+            markers.append(len(self))
+        for begin, end in zip(markers[::2], markers[1::2]):
+            yield from range(begin + 1, end)
+
+    def split_harts(self):
+        """One trace per hart id, in order of first appearance"""
+        if len(set(self.harts)) <= 1:
+            return {hart: self for hart in self.harts[:1]}
+        markers = set(self.markers)
+        columns = ['offsets', 'lengths', 'addresses', 'address_widths', 'codes', 'cycles',
+                   'mnemo_ids', 'flag_ids']
+        traces = {}
+        for i, hart in enumerate(self.harts):
+            trace = traces.get(hart)
+            if trace is None:
+                trace = traces[hart] = ParsedTrace()
+                # Mnemonic and flag ids keep referring to the shared tables
+                trace.mnemos = self.mnemos
+                trace.flags = self.flags
+            if i in markers:
+                trace.markers.append(len(trace))
+            trace.harts.append(hart)
+            for column in columns:
+                getattr(trace, column).append(getattr(self, column)[i])
+        return traces
+
+def parse_parallel(path, pattern, groups, marker_pattern, workers=None):
+    """Parse a trace with a pool of worker processes (in this process if workers is 1)"""
+    workers = workers or os.cpu_count()
+    parsed = ParsedTrace()
+    if workers == 1:
+        parsed.append(_parse_range(path, pattern, groups, marker_pattern,
+                                   0, os.path.getsize(path)))
+        return parsed
+    ranges = split_ranges(path, 4 * workers)
+    args = [(path, pattern, groups, marker_pattern, start, end) for start, end in ranges]
+    with Pool(workers) as pool:
+        # In file order, each chunk being released once appended
+        for chunk in pool.imap(_parse_args, args):
+            parsed.append(chunk)
+    return parsed
@@ -0,0 +1,97 @@
+"""
+Evaluates branch predictor sizes without simulating the pipeline
+
+Prediction accuracy only depends on the committed instruction stream, so the
+branches, calls and returns of a trace are replayed through one predictor of
+each size in a single pass. Predictors are updated as soon as the outcome is
+known, the update latency of the pipeline is not modelled.
+"""
+
+import sys
+import time
+import argparse
+
+from model import read_instructions, print_data
+from predictors import Ras, Btb, make_predictor, direction_predictors
+
+class SweepResult:
+    """Miss counters for one predictor size"""
+    def __init__(self, size):
+        self.size = size
+        self.lookups = 0
+        self.misses = 0
+
+    def miss_rate(self):
+        """Ratio of mispredicted lookups"""
+        return self.misses / self.lookups if self.lookups else 0
+
+def static_prediction(instr):
+    """Backward taken, forward not taken"""
+    return instr.offset() >> 31 != 0
+
+def sweep(instructions, bht_sizes=(128,), ras_depths=(2,), btb_sizes=(), predictor='bimodal'):
+    """Replay branches, returns and register jumps through predictors of all sizes"""
+    bhts = [(make_predictor(predictor, n), SweepResult(n)) for n in bht_sizes]
+    rass = [(Ras(n), SweepResult(n)) for n in ras_depths]
+    btbs = [(Btb(n), SweepResult(n)) for n in btb_sizes]
+    last = None
+    for instr in instructions:
+        if last is not None:
+            if last.is_branch():
+                taken = instr.address != last.next_addr()
+                for bht, result in bhts:
+                    pred = bht.predict(last.address)
+                    if pred is None:
+                        pred = static_prediction(last)
+                    result.lookups += 1
+                    if pred != taken:
+                        result.misses += 1
+                    bht.resolve(last.address, taken)
+            if last.is_ret():
+                for ras, result in rass:
+                    result.lookups += 1
+                    if ras.read() != instr.address:
+                        result.misses += 1
+            elif btbs and last.is_regjump():
+                for btb, result in btbs:
+                    result.lookups += 1
+                    if btb.predict(last.address) != instr.address:
+                        result.misses += 1
+                    btb.resolve(last.address, instr.address)
+        if instr.is_ret() or instr.is_call():
+            for ras, _ in rass:
+                ras.resolve(instr)
+        last = instr
+    return [r for _, r in bhts], [r for _, r in rass], [r for _, r in btbs]
+
+def print_results(name, results):
+    """Print miss rates of a predictor sweep"""
+    for result in results:
+        print_data(
+            f"{name} {result.size}",
+            f"{result.misses}/{result.lookups} misses ({100 * result.miss_rate():.2f}%)")
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", help="RVFI trace")
+    parser.add_argument("--bht", type=int, nargs="+", default=[16, 32, 64, 128, 256, 512],
+                        help="BHT sizes (entries)")
+    parser.add_argument("--ras", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="RAS depths")
+    parser.add_argument("--btb", type=int, nargs="*", default=[],
+                        help="BTB sizes (entries)")
+    parser.add_argument("--predictor", choices=direction_predictors, default="bimodal",
+                        help="direction predictor")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    bht_results, ras_results, btb_results = sweep(
+        read_instructions(args.trace), args.bht, args.ras, args.btb, args.predictor)
+    print_results(f"{args.predictor} entries", bht_results)
+    print_results("RAS depth", ras_results)
+    print_results("BTB entries", btb_results)
+    print_data("elapsed", f"{time.time() - start:.2f}s")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
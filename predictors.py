@@ -0,0 +1,222 @@
+"""
+Branch predictors of the cva6
+
+Tables are preallocated arrays indexed by the instruction address, so that
+lookups and updates are O(1) and do not allocate.
+"""
+
+from array import array
+
+class Ras:
+    "Return Address Stack"
+    def __init__(self, depth=2, debug=False):
+        self.depth = depth - 1
+        self.stack = []
+        self.debug = debug
+        self.last_dropped = None
+
+    def push(self, addr):
+        "Push an address on the stack, forget oldest entry if full"
+        self.stack.append(addr)
+        self._debug(f"pushed 0x{addr:08X}")
+        if len(self.stack) > self.depth:
+            self.stack.pop(0)
+            self._debug("overflown")
+
+    def drop(self):
+        "Drop an address from the stack"
+        self._debug("dropping")
+        if len(self.stack) > 0:
+            self.last_dropped = self.stack.pop()
+        else:
+            self.last_dropped = None
+            self._debug("was already empty")
+
+    def read(self):
+        "Read the top of the stack without modifying it"
+        self._debug("reading")
+        if self.last_dropped is not None:
+            addr = self.last_dropped
+            self._debug(f"read 0x{addr:08X}")
+            return addr
+        self._debug("was empty")
+        return None
+
+    def resolve(self, instr, decoded=None):
+        "Push or pop depending on the instruction, decoded if given"
+        self._debug(f"issuing {instr}")
+        if decoded is None:
+            is_ret, is_call, size = instr.is_ret(), instr.is_call(), instr.size()
+        else:
+            is_ret, is_call, size = decoded.is_ret, decoded.is_call, decoded.size
+        if is_ret:
+            self._debug("detected ret")
+            self.drop()
+        if is_call:
+            self._debug("detected call")
+            self.push(instr.address + size)
+
+    def state(self):
+        "Hashable contents"
+        return tuple(self.stack), self.last_dropped
+
+    def _debug(self, message):
+        if self.debug:
+            print(f"RAS: {message}")
+
+class Bht:
+    "Branch History Table"
+
+    def __init__(self, entries=128):
+        self.entries = entries
+        self.valid = bytearray(entries)
+        self.counters = bytearray(entries)
+
+    def predict(self, addr):
+        "Is the branch taken? None if don't know"
+        index = self._index(addr)
+        if self.valid[index]:
+            return self.counters[index] >= 2
+        return None
+
+    def resolve(self, addr, taken):
+        "Update branch prediction"
+        index = self._index(addr)
+        self.valid[index] = 1
+        counter = self.counters[index]
+        if taken:
+            if counter < 3:
+                self.counters[index] = counter + 1
+        else:
+            if counter > 0:
+                self.counters[index] = counter - 1
+
+    def state(self):
+        "Hashable contents"
+        return bytes(self.valid), bytes(self.counters)
+
+    def _index(self, addr):
+        return (addr >> 1) % self.entries
+
+class Gshare:
+    "Global history XOR-ed with the address to index saturating counters"
+
+    def __init__(self, entries=128, history_bits=None):
+        self.entries = entries
+        if history_bits is None:
+            history_bits = max(entries.bit_length() - 1, 1)
+        self.history_mask = (1 << history_bits) - 1
+        self.history = 0
+        self.valid = bytearray(entries)
+        self.counters = bytearray(entries)
+
+    def predict(self, addr):
+        "Is the branch taken? None if don't know"
+        index = self._index(addr)
+        if self.valid[index]:
+            return self.counters[index] >= 2
+        return None
+
+    def resolve(self, addr, taken):
+        "Update branch prediction and global history"
+        index = self._index(addr)
+        self.valid[index] = 1
+        counter = self.counters[index]
+        if taken:
+            if counter < 3:
+                self.counters[index] = counter + 1
+        else:
+            if counter > 0:
+                self.counters[index] = counter - 1
+        self.history = ((self.history << 1) | taken) & self.history_mask
+
+    def state(self):
+        "Hashable contents"
+        return self.history, bytes(self.valid), bytes(self.counters)
+
+    def _index(self, addr):
+        return ((addr >> 1) ^ self.history) % self.entries
+
+class Tournament:
+    "Chooses between a bimodal and a gshare predictor"
+
+    def __init__(self, entries=128):
+        self.entries = entries
+        self.bimodal = Bht(entries)
+        self.gshare = Gshare(entries)
+        # >= 2 selects gshare
+        self.choosers = bytearray([1]) * entries
+
+    def predict(self, addr):
+        "Is the branch taken? None if don't know"
+        local = self.bimodal.predict(addr)
+        shared = self.gshare.predict(addr)
+        if self.choosers[self._index(addr)] >= 2:
+            return local if shared is None else shared
+        return shared if local is None else local
+
+    def resolve(self, addr, taken):
+        "Train the chooser towards the right component, then both components"
+        local = self.bimodal.predict(addr)
+        shared = self.gshare.predict(addr)
+        if local is not None and shared is not None and local != shared:
+            index = self._index(addr)
+            chooser = self.choosers[index]
+            if shared == taken:
+                if chooser < 3:
+                    self.choosers[index] = chooser + 1
+            else:
+                if chooser > 0:
+                    self.choosers[index] = chooser - 1
+        self.bimodal.resolve(addr, taken)
+        self.gshare.resolve(addr, taken)
+
+    def state(self):
+        "Hashable contents"
+        return self.bimodal.state(), self.gshare.state(), bytes(self.choosers)
+
+    def _index(self, addr):
+        return (addr >> 1) % self.entries
+
+class Btb:
+    "Branch Target Buffer, predicts the destination of register jumps"
+
+    def __init__(self, entries=32):
+        self.entries = entries
+        self.valid = bytearray(entries)
+        self.tags = array('Q', bytes(8 * entries))
+        self.targets = array('Q', bytes(8 * entries))
+
+    def predict(self, addr):
+        "Destination address, None if don't know"
+        index = self._index(addr)
+        if self.valid[index] and self.tags[index] == addr:
+            return self.targets[index]
+        return None
+
+    def resolve(self, addr, target):
+        "Record the destination of a register jump"
+        index = self._index(addr)
+        self.valid[index] = 1
+        self.tags[index] = addr
+        self.targets[index] = target
+
+    def state(self):
+        "Hashable contents"
+        return bytes(self.valid), self.tags.tobytes(), self.targets.tobytes()
+
+    def _index(self, addr):
+        return (addr >> 1) % self.entries
+
+direction_predictors = {
+    'bimodal': Bht,
+    'gshare': Gshare,
+    'tournament': Tournament,
+}
+
+def make_predictor(name, entries):
+    "Build a direction predictor from its name"
+    if name not in direction_predictors:
+        known = ", ".join(direction_predictors)
+        raise ValueError(f"unknown branch predictor '{name}' (known: {known})")
+    return direction_predictors[name](entries)
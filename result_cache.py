@@ -0,0 +1,219 @@
+"""
+Content-addressed on-disk cache of simulation results
+
+Results are keyed by a hash of the trace contents, of the model sources (the
+modules model.py imports, recursively) and of the full parameter set. Least recently used entries are evicted when the
+cache grows over its size limit.
+"""
+
+import os
+import sys
+import json
+import time
+import ast
+import shutil
+import hashlib
+
+CACHE_DIR = os.environ.get(
+    "CVA6_MODEL_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "cva6-perf-model"))
+MAX_SIZE = int(os.environ.get("CVA6_MODEL_CACHE_SIZE", 1 << 30))
+
+# Modules whose local imports are hashed with them, recursively
+SOURCES = ["model.py"]
+
+def file_digest(path):
+    """SHA-256 of a file contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Imported module names by source path and modification time
+_imports = {}
+
+def local_imports(path):
+    """Names of the modules imported by a source file when it is loaded
+
+    Imports in functions or under `if __name__ == "__main__"` are not counted."""
+    stamp = (path, os.stat(path).st_mtime_ns)
+    if stamp not in _imports:
+        with open(path, encoding="utf8") as file:
+            tree = ast.parse(file.read(), path)
+        names = []
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                names.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names.append(node.module)
+        _imports[stamp] = names
+    return _imports[stamp]
+
+def model_sources(directory):
+    """SOURCES and the modules of the directory they import, recursively"""
+    sources = []
+    pending = list(SOURCES)
+    while pending:
+        name = pending.pop()
+        if name in sources:
+            continue
+        sources.append(name)
+        for module in local_imports(os.path.join(directory, name)):
+            if os.path.exists(os.path.join(directory, module + ".py")):
+                pending.append(module + ".py")
+    return sorted(sources)
+
+def source_version():
+    """Hash of the model sources, results of another model are not reused"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in model_sources(here):
+        digest.update(name.encode())
+        digest.update(file_digest(os.path.join(here, name)).encode())
+    return digest.hexdigest()
+
+class ResultCache:
+    """Summary statistics (and annotated traces) stored in a directory"""
+
+    def __init__(self, directory=CACHE_DIR, max_size=MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def trace_digest(self, path):
+        """Content hash of a trace, remembered while the file is unchanged"""
+        stat = os.stat(path)
+        stamp = f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        digests_path = os.path.join(self.directory, "traces.json")
+        digests = self._read_json(digests_path) or {}
+        if stamp not in digests:
+            digests[stamp] = file_digest(path)
+            self._write_json(digests_path, digests)
+        return digests[stamp]
+
+    def key(self, trace, params):
+        """Key of a run of the model on a trace"""
+        content = json.dumps({
+            "trace": self.trace_digest(trace),
+            "model": source_version(),
+            "params": params,
+        }, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key, annotated=None):
+        """Cached statistics, None if missing. Copies the annotated trace if asked"""
+        entry = self.read(key)
+        if entry is None:
+            return None
+        if annotated is not None:
+            if not os.path.exists(self._trace_path(key)):
+                return None
+            shutil.copyfile(self._trace_path(key), annotated)
+            os.utime(self._trace_path(key))
+        os.utime(self._entry_path(key))
+        return entry["stats"]
+
+    def put(self, key, trace, params, stats, annotated=None):
+        """Store the statistics and optionally the annotated trace of a run"""
+        if annotated is not None:
+            shutil.copyfile(annotated, self._trace_path(key))
+        self._write_json(self._entry_path(key), {
+            "trace": os.path.realpath(trace),
+            "params": params,
+            "stats": stats,
+            "created": time.time(),
+        })
+        self.evict()
+
+    def read(self, key):
+        """Whole entry (trace path, parameters, statistics), None if missing"""
+        return self._read_json(self._entry_path(key))
+
+    def entries(self):
+        """All entries as (key, size in bytes, last access time), oldest first"""
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == "traces.json":
+                continue
+            key = name[:-len(".json")]
+            size = 0
+            for path in [self._entry_path(key), self._trace_path(key)]:
+                if os.path.exists(path):
+                    size += os.path.getsize(path)
+            found.append((key, size, os.path.getmtime(self._entry_path(key))))
+        return sorted(found, key=lambda e: e[2])
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_size:
+                break
+            self.remove(key)
+            total -= size
+
+    def remove(self, key):
+        """Remove an entry"""
+        for path in [self._entry_path(key), self._trace_path(key)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        """Remove all entries"""
+        for key, _, _ in self.entries():
+            self.remove(key)
+        digests_path = os.path.join(self.directory, "traces.json")
+        if os.path.exists(digests_path):
+            os.remove(digests_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _trace_path(self, key):
+        return os.path.join(self.directory, f"{key}.log")
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, "r", encoding="utf8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_json(path, content):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf8") as file:
+            json.dump(content, file)
+        os.replace(tmp, path)
+
+def main(argv):
+    "Entry point: inspect or clear the cache"
+    usage = f"usage: {sys.argv[0]} info|list|clear"
+    if len(argv) != 1:
+        print(usage)
+        return 1
+    cache = ResultCache()
+    entries = cache.entries()
+    if argv[0] == "info":
+        print(f"directory: {cache.directory}")
+        print(f"entries:   {len(entries)}")
+        print(f"size:      {sum(e[1] for e in entries)} / {cache.max_size} bytes")
+    elif argv[0] == "list":
+        for key, size, accessed in entries:
+            entry = cache.read(key) or {}
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(accessed))
+            cycles = entry.get("stats", {}).get("cycles")
+            print(f"{key[:16]} {when} {size:>10} {cycles} {entry.get('trace')} {entry.get('params')}")
+    elif argv[0] == "clear":
+        cache.clear()
+        print(f"removed {len(entries)} entries")
+    else:
+        print(usage)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,52 @@
+"""
+Regions of interest: the parts of a trace simulated cycle by cycle
+
+Outside of them, the model only updates its branch predictors.
+"""
+
+import re
+
+re_csrr_minstret = re.compile(r"^csrr\s+\w\w,\s*minstret$")
+
+class MinstretRoi:
+    """Between pairs of `csrr minstret`, markers included (timed part)"""
+    def __init__(self):
+        self.inside = False
+
+    def selects(self, instr, index):
+        """Is the instruction number index in the region?"""
+        if re_csrr_minstret.search(instr.mnemo):
+            self.inside = not self.inside
+            return True
+        return self.inside
+
+class AddressRoi:
+    """Instructions whose address is in one of the [start, end) ranges"""
+    def __init__(self, ranges):
+        self.ranges = list(ranges)
+
+    def selects(self, instr, index):
+        """Is the instruction number index in the region?"""
+        return any(start <= instr.address < end for start, end in self.ranges)
+
+class CountRoi:
+    """Instructions whose number is in one of the [start, end) ranges"""
+    def __init__(self, ranges):
+        self.ranges = list(ranges)
+
+    def selects(self, instr, index):
+        """Is the instruction number index in the region?"""
+        return any(start <= index < end for start, end in self.ranges)
+
+def parse_roi(spec):
+    """Region from 'minstret', 'addr:START-END[,START-END...]' or 'count:START-END[,...]'"""
+    if spec == "minstret":
+        return MinstretRoi()
+    kind, _, ranges = spec.partition(":")
+    if kind not in ["addr", "count"] or not ranges:
+        raise ValueError(f"bad region of interest '{spec}'")
+    bounds = []
+    for r in ranges.split(","):
+        start, _, end = r.partition("-")
+        bounds.append((int(start, 0), int(end, 0)))
+    return AddressRoi(bounds) if kind == "addr" else CountRoi(bounds)
@@ -0,0 +1,127 @@
+"""
+Adaptive design-space search by successive halving on trace prefixes
+
+All configurations are simulated on a short prefix of the trace. Only the
+best fraction is kept and simulated again on a prefix `eta` times longer,
+until the whole trace is reached or a single configuration is left. The
+score is the IPC, optionally divided by a hardware cost penalty. The result
+is the Pareto front of IPC against hardware cost on the longest prefix: the
+configurations eliminated earlier which would be on the front judged on
+their last prefix are simulated on the longest one too, before comparing.
+"""
+
+import sys
+import time
+import argparse
+import itertools
+
+from model import Lockstep, read_instructions, print_data
+
+class Result:
+    """Simulation of a configuration on a trace prefix"""
+    def __init__(self, config, n_instr, cycles, cost):
+        self.config = config
+        self.n_instr = n_instr
+        self.cycles = cycles
+        self.cost = cost
+
+    def ipc(self):
+        """Instructions per cycle"""
+        return self.n_instr / self.cycles
+
+    def __repr__(self):
+        name = " ".join(f"{k}={v}" for k, v in self.config.items())
+        return f"{name}: IPC {self.ipc():.3f}, cost {self.cost:g} ({self.n_instr} instructions)"
+
+def hardware_cost(config):
+    """Rough relative area: issue ports grow register file read ports and
+    forwarding paths quadratically, commit ports and entries linearly"""
+    defaults = {'issue': 1, 'commit': 2, 'sb_len': 8}
+    c = {**defaults, **config}
+    return c['issue'] ** 2 + c['commit'] + c['sb_len'] / 4
+
+def grid(**ranges):
+    """All combinations of parameter values"""
+    names = list(ranges)
+    return [dict(zip(names, values)) for values in itertools.product(*ranges.values())]
+
+def pareto_front(results, mixed=False):
+    """Results not dominated by another one (higher IPC for a lower or equal cost)
+
+    Only the results on the longest prefix are compared, IPC on shorter
+    prefixes being of lower fidelity, unless mixed."""
+    longest = max((r.n_instr for r in results), default=0)
+    front = []
+    compared = results if mixed else [r for r in results if r.n_instr == longest]
+    for result in sorted(compared, key=lambda r: (r.cost, -r.ipc())):
+        if not front or result.ipc() > front[-1].ipc():
+            front.append(result)
+    return front
+
+def successive_halving(instructions, configs, min_prefix=1000, eta=3, cost_weight=0.0,
+                       cost=hardware_cost, verbose=False):
+    """Results of the survivors of each rung, and the number of simulated instructions
+
+    The score of a configuration is IPC / (1 + cost_weight * cost)."""
+    def score(result):
+        return result.ipc() / (1 + cost_weight * result.cost)
+
+    latest = {}
+    simulated = 0
+    survivors = list(configs)
+    prefix = min(min_prefix, len(instructions))
+    while True:
+        part = instructions[:prefix]
+        results = []
+        for config, cycles in zip(survivors, Lockstep(survivors).run(part)):
+            result = Result(config, len(part), cycles, cost(config))
+            latest[id(config)] = result
+            results.append(result)
+            simulated += len(part)
+        if verbose:
+            print_data(f"rung {prefix}", f"{len(results)} configurations")
+        if prefix == len(instructions) or len(results) == 1:
+            break
+        results.sort(key=score, reverse=True)
+        survivors = [r.config for r in results[:max(len(results) // eta, 1)]]
+        prefix = min(prefix * eta, len(instructions))
+    # Front candidates judged on shorter prefixes are compared on the longest one
+    candidates = [r.config for r in pareto_front(list(latest.values()), mixed=True)
+                  if r.n_instr < len(part)]
+    if candidates:
+        for config, cycles in zip(candidates, Lockstep(candidates).run(part)):
+            latest[id(config)] = Result(config, len(part), cycles, cost(config))
+            simulated += len(part)
+        if verbose:
+            print_data(f"front {len(part)}", f"{len(candidates)} configurations")
+    return list(latest.values()), simulated
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", help="RVFI trace")
+    parser.add_argument("--issue", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("--commit", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("--sb-len", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--min-prefix", type=int, default=1000,
+                        help="instructions simulated in the first rung")
+    parser.add_argument("--eta", type=int, default=3,
+                        help="1/eta of the configurations survive each rung")
+    parser.add_argument("--cost-weight", type=float, default=0.0,
+                        help="penalty of the hardware cost in the score")
+    args = parser.parse_args(argv)
+
+    instructions = list(read_instructions(args.trace))
+    configs = grid(issue=args.issue, commit=args.commit, sb_len=args.sb_len)
+    start = time.time()
+    results, simulated = successive_halving(
+        instructions, configs, args.min_prefix, args.eta, args.cost_weight, verbose=True)
+    print_data("elapsed", f"{time.time() - start:.2f}s")
+    full = len(configs) * len(instructions)
+    print_data("simulated instructions", f"{simulated} ({100 * simulated / full:.1f}% of a grid)")
+    print("Pareto front:")
+    for result in pareto_front(results):
+        print(f"  {result}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
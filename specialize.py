@@ -0,0 +1,388 @@
+"""
+Step functions specialized for a configuration
+
+`Model.run_cycle` is generic: it calls a method per stage, builds
+dictionaries to dispatch functional units and tests the parameters of the
+model every cycle. For a given model, `compile_cycle`
+generates the source of an equivalent `run_cycle` in which commit ports and
+issue slots are unrolled, branches on fixed parameters (forwarding,
+renaming, instruction cache, BTB, divider, CPI stack) are folded away, and
+decoded static instructions are read from the table shared with the
+generic model. `attach(model)` compiles it when the run starts.
+
+The state stays in the model, so that memoization, metrics and regions of
+interest work unchanged. Functional units are updated at the end of the
+cycle, event subscribers must not read them.
+"""
+
+import sys
+import time
+import argparse
+import contextlib
+
+from collections import Counter
+
+from model import (Model, Event, Entry, LastIssue, EventKind, decoded, decode,
+                   read_instructions, print_data)
+
+FUS = ['ALU', 'MUL', 'BRANCH', 'LDU', 'STU']
+
+class Emitter:
+    """Lines of Python source with indentation"""
+
+    def __init__(self):
+        self.lines = []
+        self.depth = 0
+
+    def __call__(self, line):
+        self.lines.append("    " * self.depth + line if line else "")
+
+    @contextlib.contextmanager
+    def indent(self):
+        """Context manager for an indented block"""
+        self.depth += 1
+        yield
+        self.depth -= 1
+
+    def source(self):
+        """The source code"""
+        return "\n".join(self.lines) + "\n"
+
+def emit_event(emit, record_events, instr, kind):
+    """Inline Model.log_event_on"""
+    if record_events:
+        emit(f"event = Event({kind}, cycle)")
+        emit(f"if {instr}.events:")
+        with emit.indent():
+            emit(f"{instr}.events.append(event)")
+        emit("else:")
+        with emit.indent():
+            emit(f"{instr}.events = [event]")
+        emit(f"for callback in subscribers_{kind}:")
+        with emit.indent():
+            emit(f"callback({instr}, event)")
+    else:
+        # Nobody sees events which are neither recorded nor subscribed to
+        emit(f"if subscribers_{kind}:")
+        with emit.indent():
+            emit(f"event = Event({kind}, cycle)")
+            emit(f"for callback in subscribers_{kind}:")
+            with emit.indent():
+                emit(f"callback({instr}, event)")
+
+def emit_fu_dispatch(emit, cases):
+    """if/elif chain on the functional unit index d.fu_index, cases by unit name"""
+    for i, name in enumerate(FUS):
+        emit(f"{'if' if i == 0 else 'elif'} d.fu_index == {i}:" if i < len(FUS) - 1 else "else:")
+        with emit.indent():
+            for line in cases[name]:
+                emit(line)
+
+def emit_commit(emit, model, port):
+    """Inline Model.try_commit for a commit port"""
+    emit(f"# Commit port {port}")
+    emit("if not scoreboard:")
+    with emit.indent():
+        emit("stall = 'sb_empty'")
+    emit("else:")
+    with emit.indent():
+        emit("entry = scoreboard[0]")
+        emit("stall = None")
+        if port > 0:
+            emit("if decoded[entry.instr.bin].is_store:")
+            with emit.indent():
+                emit("stall = 'store_port'")
+        emit("if not entry.done:")
+        with emit.indent():
+            emit("stall = 'executing'")
+        emit("if stall is None:")
+        with emit.indent():
+            emit("instr = scoreboard.pop(0).instr")
+            emit_event(emit, model.record_events, "instr", "commit")
+            # Model.commit_manage_last_branch
+            emit("last = model.last_committed")
+            emit("if last is not None:")
+            with emit.indent():
+                # Instructions outside of a region of interest are not issued
+                emit("ld = decoded.get(last.bin) or decode(last)")
+                emit("if ld.is_branch:")
+                with emit.indent():
+                    emit("bht.resolve(last.address, instr.address != last.address + ld.size)")
+                if model.btb is not None:
+                    emit("elif ld.is_regjump and not ld.is_ret:")
+                    with emit.indent():
+                        emit("btb.resolve(last.address, instr.address)")
+            emit("model.last_committed = instr")
+    if model.cpi is not None:
+        emit("cpi.commit_slot(stall)")
+
+def emit_issue(emit, model, slot):
+    """Inline Model.try_issue for an issue slot"""
+    fetch_size = model.iqlen.fetch_size
+    emit(f"# Issue slot {slot}")
+    emit("if not queue:")
+    with emit.indent():
+        emit("stall = 'empty'")
+    emit("elif len(scoreboard) >= sb_len:")
+    with emit.indent():
+        emit("stall = 'sb_full'")
+    emit("else:")
+    with emit.indent():
+        emit("instr = queue[0]")
+        emit("d = decoded.get(instr.bin) or decode(instr)")
+        emit("stall = None")
+
+        # Model.find_data_hazards
+        emit("for entry in scoreboard:")
+        with emit.indent():
+            emit("writes = decoded[entry.instr.bin].writes")
+            emit("if writes is not None:")
+            with emit.indent():
+                if not model.has_renaming:
+                    emit("if writes == d.writes:")
+                    with emit.indent():
+                        emit_event(emit, model.record_events, "instr", "WAW")
+                        emit("stall = stall or 'WAW'")
+                forwarded = " and not entry.done" if model.has_forwarding else ""
+                emit(f"if writes in d.reads{forwarded}:")
+                with emit.indent():
+                    emit_event(emit, model.record_events, "instr", "RAW")
+                    emit("stall = 'RAW'")
+
+        # Model.find_structural_hazard
+        alu_ready = "not alu2 or not alu" if model.fus.has_alu2 else "not alu"
+        emit_fu_dispatch(emit, {
+            'ALU': [f"ready = {alu_ready}"],
+            'MUL': ["ready = not mul"],
+            'BRANCH': ["ready = not branch"],
+            'LDU': ["ready = not ldu"],
+            'STU': ["ready = not stu"],
+        })
+        if not model.pipelined_div:
+            emit("if cycle < model.div_busy_until and d.is_muldiv:")
+            with emit.indent():
+                emit("ready = False")
+        emit("if not ready:")
+        with emit.indent():
+            emit_event(emit, model.record_events, "instr", "STRUCT")
+            emit("if stall is None:")
+            with emit.indent():
+                emit("stall = d.struct_stall")
+
+        # Model.issue_manage_last_branch
+        emit("last_issued = model.last_issued")
+        emit("if last_issued is not None:")
+        with emit.indent():
+            emit("last = last_issued.instr")
+            emit("ld = decoded[last.bin]")
+            emit("pred = None")
+            emit("if ld.is_branch:")
+            with emit.indent():
+                emit("taken = bht.predict(last.address)")
+                emit("if taken is None:")
+                with emit.indent():
+                    emit("taken = ld.backward")
+                emit("pred = last.address + (ld.taken_offset if taken else ld.size)")
+            emit("elif ld.is_regjump:")
+            with emit.indent():
+                emit("if ld.is_ret:")
+                with emit.indent():
+                    emit("pred = ras.read() or 0")
+                emit("else:")
+                with emit.indent():
+                    emit("pred = btb.predict(last.address) or 0" if model.btb is not None
+                         else "pred = 0")
+            emit("if pred is not None:")
+            with emit.indent():
+                emit("bmiss = pred != instr.address")
+                emit("if bmiss and cycle < last_issued.issue_cycle + 6:")
+                with emit.indent():
+                    emit("iqlen.flush()")
+                emit("if bmiss:")
+                with emit.indent():
+                    emit("if BMISS not in head_branch_events:")
+                    with emit.indent():
+                        emit("head_branch_events.add(BMISS)")
+                        emit_event(emit, model.record_events, "instr", "BMISS")
+                emit("elif BHIT not in head_branch_events:")
+                with emit.indent():
+                    emit("head_branch_events.add(BHIT)")
+                    emit_event(emit, model.record_events, "instr", "BHIT")
+                    emit("if instr.address != last.address + ld.size:")
+                    with emit.indent():
+                        emit("iqlen.jump()")
+
+        if model.icache is not None:
+            emit("if model.icache_misses and id(instr) in model.icache_misses:")
+            with emit.indent():
+                emit("model.icache_misses.remove(id(instr))")
+                emit(f"iqlen.miss({model.icache.miss_latency})")
+
+        # IqLen.has
+        emit("length = iqlen.len")
+        emit(f"if not d.is_compressed and instr.address & {fetch_size - 1} == {fetch_size - 2}:")
+        with emit.indent():
+            emit(f"length -= {fetch_size - 2}")
+        emit("if length < d.size:")
+        with emit.indent():
+            emit("if iqlen.missing:")
+            with emit.indent():
+                emit("stall = 'ICACHE'")
+            emit("else:")
+            with emit.indent():
+                emit("stall = 'BMISS' if iqlen.refilling else 'fetch'")
+
+        emit("if stall is None:")
+        with emit.indent():
+            # IqLen.remove
+            emit("iqlen.len -= d.size")
+            emit("iqlen.refilling = False")
+            emit("iqlen.missing = False")
+            emit(f"to_remove = ((instr.address + d.size) & {fetch_size - 1}) "
+                 f"- ({fetch_size} - (iqlen.len & {fetch_size - 1}))")
+            emit("if to_remove < 0:")
+            with emit.indent():
+                emit(f"to_remove += {fetch_size}")
+            emit("iqlen.len -= to_remove")
+            emit("if d.is_jump:")
+            with emit.indent():
+                emit("iqlen.jump()")
+            emit("queue.pop(0)")
+            emit("head_branch_events.clear()")
+            emit_event(emit, model.record_events, "instr", "issue")
+            emit("done_cycle = cycle + latencies[d.kind]")
+            emit("entry = Entry(instr, done_cycle)")
+            emit(f"wheel[done_cycle % {len(model.wheel)}].append(entry)")
+            if not model.pipelined_div:
+                emit("if d.is_div:")
+                with emit.indent():
+                    emit("model.div_busy_until = done_cycle")
+            emit("scoreboard.append(entry)")
+            # FusBusy.issue
+            alu_issue = ["if alu2:", "    alu = branch = True", "else:", "    alu2 = True"] \
+                if model.fus.has_alu2 else ["alu = branch = True"]
+            emit_fu_dispatch(emit, {
+                'ALU': alu_issue,
+                'MUL': ["mul = issued_mul = True"],
+                'BRANCH': ["alu = branch = stu = True"],
+                'LDU': ["ldu = stu = True"],
+                'STU': ["stu = ldu = True"],
+            })
+            emit("model.last_issued = LastIssue(instr, cycle)")
+            # Ras.resolve
+            emit("if d.is_ret:")
+            with emit.indent():
+                emit("ras.drop()")
+            emit("if d.is_call:")
+            with emit.indent():
+                emit("ras.push(instr.address + d.size)")
+    if model.cpi is not None:
+        emit("cpi.issue_slot(stall)")
+
+def cycle_source(model):
+    """Source of make_run_cycle(model, env), which returns the specialized run_cycle"""
+    emit = Emitter()
+    emit("def make_run_cycle(model, env):")
+    with emit.indent():
+        for name in ['Event', 'Entry', 'LastIssue', 'decoded', 'decode']:
+            emit(f"{name} = env['{name}']")
+        for kind in ['issue', 'done', 'commit', 'RAW', 'WAW', 'STRUCT', 'BHIT', 'BMISS']:
+            emit(f"{kind} = env['EventKind'].{kind}")
+            emit(f"subscribers_{kind} = model.subscribers[{kind}]")
+        emit("bht, ras, btb, cpi = model.bht, model.ras, model.btb, model.cpi")
+        emit("latencies = model.latencies")
+        emit(f"sb_len = {model.sb_len}")
+        emit("")
+        emit("def run_cycle(cycle):")
+        with emit.indent():
+            emit("scoreboard = model.scoreboard")
+            emit("queue = model.instr_queue")
+            emit("wheel = model.wheel")
+            emit("iqlen = model.iqlen")
+            emit("head_branch_events = model.head_branch_events")
+            # FusBusy.cycle
+            emit("fus = model.fus")
+            emit("alu = branch = fus.issued_mul")
+            emit("mul = ldu = stu = alu2 = issued_mul = False")
+            for port in range(model.commit_width):
+                emit_commit(emit, model, port)
+            # Model.try_execute
+            emit(f"slot = cycle % {len(model.wheel)}")
+            emit("completing = wheel[slot]")
+            emit("if completing:")
+            with emit.indent():
+                emit("wheel[slot] = []")
+                emit("for entry in completing:")
+                with emit.indent():
+                    emit("instr = entry.instr")
+                    emit_event(emit, model.record_events, "instr", "done")
+                    emit("entry.done = True")
+            for slot in range(model.issue_width):
+                emit_issue(emit, model, slot)
+            emit("fus.alu, fus.mul, fus.branch = alu, mul, branch")
+            emit("fus.ldu, fus.stu, fus.alu2, fus.issued_mul = ldu, stu, alu2, issued_mul")
+            # IqLen.fetch
+            emit("if iqlen.stall_cycles > 0:")
+            with emit.indent():
+                emit("iqlen.stall_cycles -= 1")
+            emit("else:")
+            with emit.indent():
+                emit(f"iqlen.len += {model.iqlen.fetch_size}")
+                emit("iqlen.new_fetch = True")
+        emit("")
+        emit("return run_cycle")
+    return emit.source()
+
+def compile_cycle(model):
+    """Specialized run_cycle of a model"""
+    env = {'Event': Event, 'Entry': Entry, 'LastIssue': LastIssue, 'EventKind': EventKind,
+           'decoded': decoded, 'decode': decode}
+    namespace = {}
+    exec(compile(cycle_source(model), "<specialized run_cycle>", "exec"), namespace) # pylint: disable=exec-used
+    return namespace['make_run_cycle'](model, env)
+
+def attach(model):
+    """Run a model with a run_cycle specialized for its configuration, as
+    configured when the run starts (the generic one in debug mode)"""
+    def specialize(model):
+        if not model.debug:
+            model.run_cycle = compile_cycle(model)
+    model.subscribe_start(specialize)
+
+def timeline(config, instructions, specialized):
+    """Cycles, commit cycles and event counts of a run, and its duration"""
+    model = Model(keep_retired=False, keep_log=False, record_events=False, **config)
+    if specialized:
+        attach(model)
+    model.load_stream(instructions)
+    counts = Counter()
+    commits = []
+    model.subscribe(lambda instr, event: counts.update([event.kind.name]))
+    model.subscribe(lambda instr, event: commits.append(event.cycle), [EventKind.commit])
+    start = time.time()
+    cycles = model.run()
+    return (cycles, commits, counts), time.time() - start
+
+def main(argv):
+    "Entry point: check a specialized run against the generic one, and time both"
+    parser = argparse.ArgumentParser(description="Specialized step function check")
+    parser.add_argument("trace", help="RVFI trace")
+    parser.add_argument("--issue", type=int, default=2)
+    parser.add_argument("--commit", type=int, default=2)
+    parser.add_argument("--sb-len", type=int, default=8)
+    parser.add_argument("--show", action="store_true", help="print the generated source")
+    args = parser.parse_args(argv)
+
+    config = dict(issue=args.issue, commit=args.commit, sb_len=args.sb_len)
+    if args.show:
+        print(cycle_source(Model(**config)))
+    instructions = list(read_instructions(args.trace))
+    generic, generic_time = timeline(config, instructions, False)
+    specialized, specialized_time = timeline(config, instructions, True)
+    print_data("generic", f"{generic[0]} cycles in {generic_time:.2f}s")
+    print_data("specialized", f"{specialized[0]} cycles in {specialized_time:.2f}s")
+    print_data("speedup", f"{generic_time / specialized_time:.2f}x")
+    print_data("identical", generic == specialized)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,199 @@
+"""
+Differential comparison of the commit timelines of two configurations
+
+Both models run over the same trace, the one which committed fewer
+instructions being stepped first, so that only the instructions committed
+by one model and not yet by the other are kept in memory. The two timelines
+can also be read from annotated traces written by previous runs.
+
+The cost of an instruction is the number of cycles between the commit of
+the previous instruction and its own. The difference of costs between the
+two timelines sums to the difference of cycles, and is aggregated by PC and
+by the hazards which differ on the instruction (e.g. `-RAW +STRUCT` when
+only the second configuration stalls it on a structural hazard).
+"""
+
+import sys
+import argparse
+import itertools
+
+from collections import Counter, deque
+
+from model import Model, EventKind, print_data, read_instructions
+from roi import re_csrr_minstret
+
+# Events which are not hazards or branch outcomes
+PIPELINE = {'issue', 'done', 'commit'}
+
+class Timeline:
+    """Commits of a model as (address, mnemonic, cycle, event kinds)"""
+
+    def __init__(self, config):
+        self.model = Model(keep_retired=False, keep_log=False, record_events=False, **config)
+        self.model.subscribe(self.event)
+        self.commits = deque()
+        self.n_committed = 0
+        # Event kinds of the instructions not committed yet, by id
+        self.in_flight = {}
+
+    def event(self, instr, event):
+        """Event subscriber, for events of all kinds"""
+        kind = event.kind.name
+        kinds = self.in_flight.setdefault(id(instr), set())
+        if kind not in PIPELINE:
+            kinds.add(kind)
+        if event.kind == EventKind.commit:
+            del self.in_flight[id(instr)]
+            self.commits.append((instr.address, instr.mnemo, event.cycle, frozenset(kinds)))
+            self.n_committed += 1
+
+def run_timelines(instructions, config_a, config_b, batch_size=1024):
+    """Iterate over the commits of two models, pairwise, in bounded memory"""
+    sides = [Timeline(config_a), Timeline(config_b)]
+    source = iter(instructions)
+    for side in sides:
+        side.model.start()
+    while True:
+        batch = list(itertools.islice(source, batch_size))
+        for side in sides:
+            side.model.feed(batch)
+        while True:
+            # Instructions stay queued, as when the whole trace is loaded
+            ready = [side for side in sides if (
+                len(side.model.instr_queue) > side.model.stream_lookahead
+                if batch else side.model.running())]
+            if not ready:
+                break
+            min(ready, key=lambda side: side.n_committed).model.step()
+            a, b = sides[0].commits, sides[1].commits
+            while a and b:
+                yield a.popleft(), b.popleft()
+        if not batch:
+            break
+    for side in sides:
+        side.model.finish()
+
+def read_timeline(path):
+    """Commits from an annotated trace, without events"""
+    with open(path, encoding="utf8") as file:
+        for line in file:
+            found = Model.re_instr.search(line)
+            if found:
+                address, cycle = int(found.group(3), 16), int(found.group(5))
+                yield address, found.group(6).strip(), cycle, frozenset()
+
+def hazard_change(kinds_a, kinds_b):
+    """Name of the difference between the events of an instruction in two timelines"""
+    change = [f"-{k}" for k in sorted(kinds_a - kinds_b)] \
+        + [f"+{k}" for k in sorted(kinds_b - kinds_a)]
+    return " ".join(change) or "same events"
+
+class TimelineDiff:
+    """Cycle deltas of two timelines, aggregated by PC and by hazard change"""
+
+    def __init__(self, timed_only=True, output=None):
+        self.timed_only = timed_only
+        self.accepting = not timed_only
+        self.output = output
+        self.n_instr = 0
+        self.previous = None
+        self.first_divergence = None
+        self.delta = 0
+        self.by_pc = Counter()
+        self.by_change = Counter()
+        self.instr_by_change = Counter()
+        self.mnemos = {}
+
+    def add(self, commit_a, commit_b):
+        """Compare the commits of an instruction"""
+        address, mnemo, cycle_a, kinds_a = commit_a
+        address_b, _, cycle_b, kinds_b = commit_b
+        if address != address_b:
+            raise ValueError(f"timelines differ at instruction {self.n_instr}: "
+                             f"0x{address:08x} and 0x{address_b:08x}")
+        previous, self.previous = self.previous, (cycle_a, cycle_b)
+        index = self.n_instr
+        self.n_instr += 1
+        if self.timed_only and re_csrr_minstret.search(mnemo):
+            self.accepting = not self.accepting
+            return
+        if not self.accepting or previous is None:
+            return
+        delta = (cycle_b - previous[1]) - (cycle_a - previous[0])
+        if delta and self.first_divergence is None:
+            self.first_divergence = (index, address, mnemo, cycle_a, cycle_b)
+        change = hazard_change(kinds_a, kinds_b)
+        self.delta += delta
+        self.by_pc[address] += delta
+        self.mnemos[address] = mnemo
+        self.by_change[change] += delta
+        self.instr_by_change[change] += 1
+        if self.output is not None:
+            self.output.write(f"{index},0x{address:08x},{mnemo},{cycle_a},{cycle_b},{delta}\n")
+
+    def report(self, top=10):
+        """Print the first divergence and the largest gains and losses"""
+        print_data("instructions", self.n_instr)
+        print_data("cycle delta", self.delta)
+        if self.first_divergence is None:
+            print("no divergence")
+            return
+        index, address, mnemo, cycle_a, cycle_b = self.first_divergence
+        print_data("first divergence",
+                   f"#{index} 0x{address:08x} {mnemo} (commit @{cycle_a} / @{cycle_b})")
+        print("By hazard change:")
+        for change, delta in sorted(self.by_change.items(), key=lambda item: item[1]):
+            if delta:
+                print_data(f"  {change}", f"{delta:+d} cycles on {self.instr_by_change[change]} "
+                           "instructions")
+        ranked = sorted((item for item in self.by_pc.items() if item[1]), key=lambda item: item[1])
+        print("Largest gains by PC:")
+        for address, delta in ranked[:top]:
+            if delta < 0:
+                print_data(f"  0x{address:08x}", f"{delta:+d}  {self.mnemos[address]}")
+        print("Largest losses by PC:")
+        for address, delta in reversed(ranked[-top:]):
+            if delta > 0:
+                print_data(f"  0x{address:08x}", f"{delta:+d}  {self.mnemos[address]}")
+
+def parse_config(spec):
+    """Parameters from 'name=value,name=value', values are integers, booleans or strings"""
+    config = {}
+    for item in filter(None, spec.split(",")):
+        name, _, value = item.partition("=")
+        try:
+            config[name] = int(value, 0)
+        except ValueError:
+            config[name] = {'True': True, 'False': False}.get(value, value)
+    return config
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", help="RVFI trace, or annotated trace of the first timeline")
+    parser.add_argument("-a", default="issue=1", help="first configuration, e.g. 'issue=1'")
+    parser.add_argument("-b", default="issue=2", help="second configuration")
+    parser.add_argument("--annotated", metavar="TRACE",
+                        help="compare 'trace' with this annotated trace instead of running")
+    parser.add_argument("--all", action="store_true", help="not only the timed part")
+    parser.add_argument("--output", metavar="CSV", help="write the delta of each instruction")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w", encoding="utf8") if args.output else None
+    if output is not None:
+        output.write("index,pc,mnemo,cycle_a,cycle_b,delta\n")
+    diff = TimelineDiff(not args.all, output)
+    if args.annotated:
+        pairs = zip(read_timeline(args.trace), read_timeline(args.annotated))
+    else:
+        pairs = run_timelines(read_instructions(args.trace),
+                              parse_config(args.a), parse_config(args.b))
+    for commit_a, commit_b in pairs:
+        diff.add(commit_a, commit_b)
+    if output is not None:
+        output.close()
+    diff.report(args.top)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,134 @@
+"""
+Seekable index of an RVFI trace
+
+Built once per trace and stored next to it (`<trace>.index.json`), the index
+holds the file offset and simulator cycle of every `interval`-th instruction
+and the positions of the `csrr minstret` markers. Only the instructions of
+the first hart of the trace are indexed. Instruction and cycle
+ranges of a huge trace can then be read without parsing what precedes them.
+The index is built again when the trace changes.
+"""
+
+import os
+import json
+import bisect
+
+from array import array
+
+class TraceIndex:
+    """Offsets and cycles of every interval-th instruction, marker positions"""
+
+    def __init__(self, path, regex, groups, interval=1024):
+        """regex: the regular expression of instruction lines, groups: its Groups"""
+        self.path = path
+        self.regex = regex
+        self.groups = groups
+        self.interval = interval
+        self.offsets = array('Q')
+        self.cycles = array('Q')
+        self.markers = []
+        self.n_instr = 0
+        self.hart = None
+
+    def index_path(self):
+        """Where the index is stored"""
+        return self.path + ".index.json"
+
+    def _identity(self):
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def build(self, marker_regex):
+        """Index the trace in one pass"""
+        groups = self.groups
+        offset = 0
+        n_instr = 0
+        with open(self.path, "rb") as file:
+            for raw in file:
+                found = self.regex.search(raw.decode("utf8"))
+                if found and self.hart is None:
+                    self.hart = int(found.group(groups.hart))
+                if found and int(found.group(groups.hart)) == self.hart:
+                    if n_instr % self.interval == 0:
+                        self.offsets.append(offset)
+                        self.cycles.append(int(found.group(groups.cycle)))
+                    if marker_regex.search(found.group(groups.mnemo).strip()):
+                        self.markers.append(n_instr)
+                    n_instr += 1
+                offset += len(raw)
+        self.n_instr = n_instr
+
+    def save(self):
+        """Write the index next to the trace"""
+        with open(self.index_path(), "w", encoding="utf8") as file:
+            json.dump({
+                "trace": self._identity(),
+                "interval": self.interval,
+                "instructions": self.n_instr,
+                "hart": self.hart,
+                "offsets": self.offsets.tolist(),
+                "cycles": self.cycles.tolist(),
+                "markers": self.markers,
+            }, file)
+
+    def load(self):
+        """Read the index, False if missing or out of date"""
+        try:
+            with open(self.index_path(), encoding="utf8") as file:
+                content = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if content["trace"] != self._identity() or content["interval"] != self.interval \
+                or "hart" not in content:
+            return False
+        self.n_instr = content["instructions"]
+        self.hart = content["hart"]
+        self.offsets = array('Q', content["offsets"])
+        self.cycles = array('Q', content["cycles"])
+        self.markers = content["markers"]
+        return True
+
+    def seek(self, n):
+        """Offset of the indexed instruction at or before instruction n, and its number"""
+        if not self.offsets:
+            return 0, 0
+        k = min(n // self.interval, len(self.offsets) - 1)
+        return self.offsets[k], k * self.interval
+
+    def instruction_at_cycle(self, cycle):
+        """Number of the first instruction of the trace at or after a cycle"""
+        if not self.offsets:
+            return 0
+        k = max(bisect.bisect_left(self.cycles, cycle) - 1, 0)
+        n = k * self.interval
+        with open(self.path, "rb") as file:
+            file.seek(self.offsets[k])
+            for raw in file:
+                found = self.regex.search(raw.decode("utf8"))
+                if found and int(found.group(self.groups.hart)) == self.hart:
+                    if int(found.group(self.groups.cycle)) >= cycle:
+                        return n
+                    n += 1
+        return n
+
+    def timed_ranges(self):
+        """[start, end) instruction ranges between pairs of markers, markers excluded"""
+        markers = self.markers + [self.n_instr] * (len(self.markers) % 2)
+        return [(begin + 1, end) for begin, end in zip(markers[::2], markers[1::2])]
+
+    def timed_within(self, start=0, end=None):
+        """Timed ranges clipped to the instructions [start, end), relative to start"""
+        end = self.n_instr if end is None else min(end, self.n_instr)
+        clipped = ((max(begin, start), min(stop, end)) for begin, stop in self.timed_ranges())
+        return [(begin - start, stop - start) for begin, stop in clipped if begin < stop]
+
+def open_index(path, regex, groups, marker_regex, interval=1024):
+    """Index of a trace, built and saved if needed"""
+    index = TraceIndex(path, regex, groups, interval)
+    if not index.load():
+        index.build(marker_regex)
+        try:
+            index.save()
+        except OSError:
+            pass # read-only directory, the index is only kept in memory
+    return index